@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session, Response
 from datetime import datetime, date
 import csv
 import io
@@ -7,10 +7,25 @@ import os
 # Import backend modules
 from backend.database import Database
 from backend.auth import Auth, login_required, admin_required, teacher_required, student_required, track_activity
+from backend.model_registry import warm_up as warm_up_face_models
+from backend.frames import DecodedFrame, read_image_upload
+from backend.recognition_pool import RecognitionBusy
 from backend.services import UserService, ClassService, AttendanceService, ClassRequestService, DashboardService, ActivityService, AttendanceSessionService
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
+# Live recognition frames: longest side (px) and JPEG quality the client should upload
+app.config['RECOGNITION_FRAME_MAX_SIDE'] = int(os.environ.get('RECOGNITION_FRAME_MAX_SIDE', 480))
+app.config['RECOGNITION_JPEG_QUALITY'] = float(os.environ.get('RECOGNITION_JPEG_QUALITY', 0.8))
+# Pause between live frame uploads (ms); the same 3 s cadence as the old poll
+app.config['LIVE_FRAME_INTERVAL_MS'] = int(os.environ.get('LIVE_FRAME_INTERVAL_MS', 3000))
+# Live sessions keep per-process state (backend/live_sessions.py). Several
+# gunicorn workers are supported: event streams poll temporary_attendance and
+# the session status, so attendance changes and finalization reach every
+# client, but per-frame recognition status only reaches streams in the worker
+# that processed the frame. Each event stream occupies a worker thread for the
+# whole session, so run gunicorn with a threaded or async worker class
+# (e.g. -k gthread --threads 16, or -k gevent); sync workers would be blocked.
 
 # Register blueprints
 from routes import auth, admin, teacher, student, api
@@ -47,6 +62,16 @@ attendance_session_service = AttendanceSessionService()
 # Initialize database
 db = Database()
 db.init_db()
+db.init_app(app)
+if os.environ.get('DB_WRITE_QUEUE') == '1':
+    # Serialise attendance (single and batch) and activity writes through one
+    # background writer; see Database.run_write for requests that already
+    # hold an open write transaction
+    db.enable_write_queue()
+
+# Build face recognition models now so no request pays model construction
+if os.environ.get('FACE_MODEL_WARMUP', '1') == '1':
+    warm_up_face_models(os.environ.get('FACE_MODELS', 'Facenet').split(','))
 
 @app.route('/')
 def index():
@@ -271,9 +296,9 @@ def admin_class_reports(class_id):
     students = class_service.get_class_students(class_id)
     
     # Add attendance statistics for each student
+    class_stats = attendance_service.get_class_attendance_stats(class_id)
     for student in students:
-        stats = attendance_service.get_attendance_stats(student['id'], class_id)
-        student.update(stats)
+        student.update(class_stats[student['id']])
     
     return render_template('admin/class_reports.html', 
                          class_data=class_data, 
@@ -453,9 +478,9 @@ def teacher_reports(class_id):
     students = class_service.get_class_students(class_id)
     
     # Add attendance statistics for each student
+    class_stats = attendance_service.get_class_attendance_stats(class_id)
     for student in students:
-        stats = attendance_service.get_attendance_stats(student['id'], class_id)
-        student.update(stats)
+        student.update(class_stats[student['id']])
     
     return render_template('teacher/reports.html', class_data=class_data, students=students)
 
@@ -511,8 +536,9 @@ def teacher_export(class_id):
     writer = csv.writer(output)
     writer.writerow(['Student Name', 'Roll Number', 'Total Days', 'Present Days', 'Absent Days', 'Attendance Rate'])
     
+    class_stats = attendance_service.get_class_attendance_stats(class_id)
     for student in students:
-        stats = attendance_service.get_attendance_stats(student['id'], class_id)
+        stats = class_stats[student['id']]
         writer.writerow([
             student['name'],
             student['roll_number'],
@@ -621,9 +647,9 @@ def face_capture():
 def validate_face_quality():
     """API endpoint to validate face quality"""
     try:
-        data = request.get_json()
-        image_data = data.get('image_data')
-        pose = data.get('pose')
+        # Raw image/jpeg, multipart or JSON with base64 image_data
+        image_data, params = read_image_upload(request)
+        pose = params.get('pose')
         
         if not image_data:
             return jsonify({'success': False, 'message': 'No image data provided'})
@@ -639,10 +665,10 @@ def validate_face_quality():
 def capture_face():
     """API endpoint to capture face data or multi-pose embedding"""
     try:
-        data = request.get_json()
-        method = data.get('method', 'camera')
-        image_data = data.get('image_data')
-        pose = data.get('pose', 'front')
+        # Raw image/jpeg, multipart or JSON with base64 image_data
+        image_data, params = read_image_upload(request)
+        method = params.get('method', 'upload' if image_data else 'camera')
+        pose = params.get('pose', 'front')
         
         if method == 'upload' and image_data:
             success, result = user_service.capture_user_face(session['user_id'], 'upload', image_data, pose)
@@ -758,6 +784,39 @@ def live_preview_attendance(session_id):
     unrecognized_faces = attendance_session_service.get_unrecognized_faces(session_id)
     return render_template('teacher/live_preview.html', temp_attendance=temp_attendance, unrecognized_faces=unrecognized_faces, session_id=session_id)
 
+@app.route('/teacher/attendance/live_preview/<int:session_id>/frames', methods=['POST'])
+@teacher_required
+def live_preview_frame(session_id):
+    """Accept the newest camera frame of a live session (raw image body)"""
+    try:
+        image, _ = read_image_upload(request)
+        if not image:
+            return jsonify({'success': False, 'message': 'No image provided'}), 400
+        if not isinstance(image, DecodedFrame):
+            image = DecodedFrame.from_base64(image)
+        
+        live = attendance_session_service.get_live_session(session_id, user_service.face_recognition)
+        try:
+            if live is None or not live.submit_frame(image):
+                return jsonify({'success': False, 'message': 'Session is not in progress'}), 409
+        except RecognitionBusy:
+            return jsonify({'success': False, 'busy': True, 'message': 'Recognition busy, retry'}), 503, {'Retry-After': '1'}
+        
+        # Recognition results arrive on the event stream, not in this response
+        return jsonify({'success': True, 'stats': live.stats()}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 400
+
+@app.route('/teacher/attendance/live_preview/<int:session_id>/events')
+@teacher_required
+def live_preview_events(session_id):
+    """Server-sent event stream of recognition and temporary attendance updates"""
+    live = attendance_session_service.get_live_session(session_id, user_service.face_recognition)
+    if live is None:
+        return jsonify({'success': False, 'message': 'Session is not in progress'}), 409
+    return Response(live.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/teacher/attendance/mark_temp', methods=['POST'])
 @teacher_required
 def mark_temp_attendance():
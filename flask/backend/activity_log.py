@@ -0,0 +1,123 @@
+import os
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+from .database import Database
+from .background import BackgroundThreads
+from .models import UserActivity
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_activity_buffer():
+    """Process-wide activity buffer for the default database, configured from ACTIVITY_* variables"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = ActivityBuffer(
+                Database(),
+                max_rows=int(os.environ.get('ACTIVITY_FLUSH_ROWS', 100)),
+                flush_interval=float(os.environ.get('ACTIVITY_FLUSH_SECONDS', 2.0)),
+                retention={
+                    'retention_days': int(os.environ.get('ACTIVITY_RETENTION_DAYS', 30)),
+                    'rollup_days': int(os.environ.get('ACTIVITY_ROLLUP_DAYS', 400)),
+                    'archive_months': int(os.environ.get('ACTIVITY_ARCHIVE_MONTHS', 12))
+                }
+            )
+        return _buffer
+
+class ActivityBuffer:
+    """Collects user_activity rows in memory and writes them in batches from a background thread"""
+
+    def __init__(self, db, max_rows=100, flush_interval=2.0, max_pending=10000, retention=None, retention_interval=3600):
+        self.activity_model = UserActivity(db)
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        # Rows kept across failed flushes; beyond this the oldest are dropped
+        self.max_pending = max_pending
+        # UserActivity.apply_retention kwargs, run every retention_interval seconds
+        self.retention = retention
+        self.retention_interval = retention_interval
+        self._next_retention = 0
+        self.dropped = 0
+        self.last_error = None
+        self._rows = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._writer = BackgroundThreads('activity-writer', self._run)
+        self._stopping = False
+
+    def add(self, user_id, activity_type, page_url=None, action_description=None, ip_address=None, user_agent=None):
+        """Queue one activity row; never blocks on the database"""
+        # Same format as SQLite's CURRENT_TIMESTAMP (UTC)
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self._cond:
+            self._ensure_started()
+            self._rows.append((user_id, activity_type, page_url, action_description, ip_address, user_agent, created_at))
+            if len(self._rows) > self.max_pending:
+                overflow = len(self._rows) - self.max_pending
+                del self._rows[:overflow]
+                self.dropped += overflow
+            if len(self._rows) >= self.max_rows:
+                self._cond.notify()
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._flush_lock:
+            with self._cond:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            try:
+                self.activity_model.log_activity_batch(rows)
+            except Exception as e:
+                print(f"Activity log flush failed, will retry: {e}")
+                self.last_error = e
+                with self._cond:
+                    self._rows[:0] = rows
+                return 0
+            self.last_error = None
+            return len(rows)
+
+    def apply_retention(self):
+        """Archive and prune old activity now; returns the number of rows archived"""
+        self._next_retention = time.monotonic() + self.retention_interval
+        try:
+            return self.activity_model.apply_retention(**self.retention)
+        except Exception as e:
+            print(f"Activity retention failed: {e}")
+            return 0
+
+    def stop(self):
+        """Flush remaining rows and stop the writer thread"""
+        with self._cond:
+            threads = self._writer.detach()
+            self._stopping = True
+            self._cond.notify()
+        for thread in threads:
+            thread.join()
+        self.flush()
+
+    def _ensure_started(self):
+        # Called with the lock held
+        if self._writer.started():
+            return
+        if self._writer.pid is None:
+            # Rows still buffered at exit are flushed by stop()
+            atexit.register(self.stop)
+        self._stopping = False
+        self._writer.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # After a failed flush, wait out the interval even if the buffer is full
+                if not self._stopping and (len(self._rows) < self.max_rows or self.last_error is not None):
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+            if self.retention is not None and time.monotonic() >= self._next_retention:
+                self.apply_retention()
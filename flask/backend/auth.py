@@ -4,6 +4,7 @@ from werkzeug.security import check_password_hash
 from datetime import datetime, timedelta
 from .database import Database
 from .models import User, UserActivity
+from .activity_log import get_activity_buffer
 
 def login_required(f):
     @wraps(f)
@@ -90,11 +91,10 @@ def track_activity(activity_type='page_view'):
             # Execute the original function
             result = f(*args, **kwargs)
             
-            # Track activity if user is logged in
+            # Track activity if user is logged in; buffered and written in the background
             if 'user_id' in session:
                 try:
-                    auth = Auth()
-                    auth.log_activity(
+                    get_activity_buffer().add(
                         user_id=session['user_id'],
                         activity_type=activity_type,
                         page_url=request.url,
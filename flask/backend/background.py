@@ -0,0 +1,31 @@
+import os
+import threading
+
+class BackgroundThreads:
+    """Daemon threads started on first use, and started again in a forked child process"""
+
+    def __init__(self, name, target, count=1):
+        self.name = name
+        self.target = target
+        self.count = count
+        self.pid = None
+        self.threads = []
+
+    def started(self):
+        """Check if the threads were started by this process"""
+        return bool(self.threads) and self.pid == os.getpid()
+
+    def start(self, *args):
+        """Start count threads running target(*args); call with the owner's lock held"""
+        self.pid = os.getpid()
+        self.threads = [
+            threading.Thread(target=self.target, args=args, name=self.name if self.count == 1 else f'{self.name}-{i}', daemon=True)
+            for i in range(self.count)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def detach(self):
+        """Forget the threads; returns the ones this process started, for the caller to join"""
+        threads, self.threads = self.threads, []
+        return threads if self.pid == os.getpid() else []
@@ -0,0 +1,212 @@
+import os
+import pickle
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Dashboard cache settings; a TTL of 0 turns caching off
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 30))
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.environ.get('DASHBOARD_CACHE_ENTRIES', 256))
+# Directory shared by all workers on a host; unset keeps the cache per process
+DASHBOARD_CACHE_DIR = os.environ.get('DASHBOARD_CACHE_DIR') or None
+
+def _plain(value):
+    """Copy sqlite3.Row results into dicts so cached values can be shared and pickled"""
+    if isinstance(value, sqlite3.Row):
+        return dict(value)
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_plain(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+class DashboardCache:
+    """TTL + LRU cache for dashboard data, invalidated by table writes.
+
+    Each entry records the generation of every table it was built from; the
+    models call invalidate() with the tables they write, which makes those
+    entries miss on their next lookup. With shared_dir set, generations and
+    entries are also kept as files there, so every gunicorn worker on the
+    host sees the same invalidations and can reuse another worker's results.
+    Entry files are pruned on each write by the same TTL and max_entries.
+    """
+
+    def __init__(self, ttl=DASHBOARD_CACHE_TTL, max_entries=DASHBOARD_CACHE_MAX_ENTRIES, shared_dir=DASHBOARD_CACHE_DIR):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared_dir = shared_dir
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_compute(self, key, tables, compute):
+        """Return the cached value for key, or compute() it if missing, expired or invalidated"""
+        if self.ttl <= 0:
+            return compute()
+        generations = self._current_generations(tables)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if self._is_fresh(entry, generations, now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+        entry = self._read_shared(key)
+        if self._is_fresh(entry, generations, now):
+            with self._lock:
+                self.shared_hits += 1
+                self._store(key, entry)
+            return entry[2]
+
+        with self._lock:
+            self.misses += 1
+        # Generations were read before computing, so a write that lands
+        # meanwhile leaves this entry already stale
+        value = _plain(compute())
+        entry = (now + self.ttl, generations, value)
+        with self._lock:
+            self._store(key, entry)
+        self._write_shared(key, entry)
+        return value
+
+    def invalidate(self, *tables):
+        """Mark entries built from any of these tables as stale"""
+        with self._lock:
+            self.invalidations += 1
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+        if self.shared_dir:
+            try:
+                for table in tables:
+                    self._atomic_write(self._generation_path(table), uuid.uuid4().hex.encode())
+            except Exception as e:
+                print(f"Could not publish dashboard cache invalidation: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'shared': bool(self.shared_dir),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.shared_hits) / lookups, 3) if lookups else 0.0,
+                'invalidations': self.invalidations
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _is_fresh(entry, generations, now):
+        return entry is not None and entry[0] > now and entry[1] == generations
+
+    def _store(self, key, entry):
+        # Called with the lock held
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _current_generations(self, tables):
+        if not self.shared_dir:
+            with self._lock:
+                return tuple(self._generations.get(table, 0) for table in tables)
+        generations = []
+        for table in tables:
+            try:
+                with open(self._generation_path(table), 'rb') as f:
+                    generations.append(f.read())
+            except FileNotFoundError:
+                generations.append(None)
+        return tuple(generations)
+
+    def _generation_path(self, table):
+        return os.path.join(self.shared_dir, f'generation-{table}')
+
+    def _entry_path(self, key):
+        return os.path.join(self.shared_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def _read_shared(self, key):
+        if not self.shared_dir:
+            return None
+        try:
+            with open(self._entry_path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable dashboard cache entry: {e}")
+            return None
+
+    def _write_shared(self, key, entry):
+        if not self.shared_dir:
+            return
+        try:
+            self._atomic_write(self._entry_path(key), pickle.dumps(entry))
+            self._prune_shared()
+        except Exception as e:
+            print(f"Could not write dashboard cache entry: {e}")
+
+    def _prune_shared(self):
+        # Drop expired entry files (and temp files left by crashed writers),
+        # then the least recently written ones beyond max_entries
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.shared_dir):
+            if not name.endswith(('.pkl', '.tmp')):
+                continue
+            path = os.path.join(self.shared_dir, name)
+            try:
+                written = os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            if written + self.ttl <= now:
+                self._remove(path)
+            elif name.endswith('.pkl'):
+                entries.append((written, path))
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another worker pruned it first
+            pass
+
+    def _atomic_write(self, path, data):
+        # Readers in other workers see either the old file or the new one
+        fd, tmp_path = tempfile.mkstemp(dir=self.shared_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+dashboard_cache = DashboardCache()
@@ -1,15 +1,285 @@
+import os
+import queue
+import atexit
 import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 from werkzeug.security import generate_password_hash
+from .embedding_codec import encode_embedding, decode_embedding, is_encoded
+from .background import BackgroundThreads
+
+class PooledConnection:
+    """Proxy for a pooled sqlite3 connection; close() hands it back to the pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pool.release(self._conn)
+
+    def __del__(self):
+        # Callers that never close (e.g. db.get_db().execute(...)) still release
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class WriteQueue:
+    """Background writer that group-commits queued writes, one savepoint per write"""
+
+    def __init__(self, pool, max_batch=200):
+        self.pool = pool
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._queue = None
+        self._writer = BackgroundThreads('db-writer', self._run)
+
+    def _ensure_started(self):
+        with self._lock:
+            if not self._writer.started():
+                self._queue = queue.Queue()
+                self._writer.start(self._queue)
+
+    def submit(self, sql, params=()):
+        """Queue a write statement; the returned Future resolves to its lastrowid"""
+        return self.submit_work(lambda conn: conn.execute(sql, params).lastrowid)
+
+    def submit_work(self, work):
+        """Queue work(conn) to run atomically; the returned Future resolves to its result"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((work, future))
+        return future
+
+    def stop(self):
+        """Flush pending writes and stop the writer thread"""
+        with self._lock:
+            threads = self._writer.detach()
+            if not threads:
+                return
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _run(self, work_queue):
+        conn = self.pool._connect(isolation_level=None)
+        running = True
+        while running:
+            item = work_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = work_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._write_batch(conn, batch)
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for work, future in batch:
+                conn.execute('SAVEPOINT queued_write')
+                try:
+                    results.append((future, work(conn), None))
+                    conn.execute('RELEASE queued_write')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO queued_write')
+                    conn.execute('RELEASE queued_write')
+                    results.append((future, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            results = [(future, None, e) for _, future in batch]
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+class ConnectionPool:
+    """Thread-safe pool of sqlite3 connections for one database file.
+
+    A thread that already holds a connection gets the same one back, so all
+    models used while serving a request share a single connection. It returns
+    to the pool (with any uncommitted work rolled back) when the last holder
+    closes it.
+    """
+
+    # Applied to every new connection. WAL lets readers run alongside the
+    # single writer; NORMAL sync is durable across app crashes in WAL mode.
+    PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 268435456,
+        'cache_size': -16000,
+    }
+
+    def __init__(self, db_path, max_size=8):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.writer = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._local = threading.local()
+
+    def _connect(self, **kwargs):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.PRAGMAS['busy_timeout'] / 1000, **kwargs)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def enable_write_queue(self):
+        with self._lock:
+            if self.writer is None:
+                self.writer = WriteQueue(self)
+                atexit.register(self.writer.stop)
+        return self.writer
+
+    def acquire(self):
+        with self._lock:
+            # Connections must not be shared across a fork (e.g. gunicorn --preload)
+            if os.getpid() != self._pid:
+                self._reset()
+            lease = getattr(self._local, 'lease', None)
+            if lease is None:
+                conn = self._idle.pop() if self._idle else None
+                lease = self._local.lease = [conn, 0]
+        if lease[0] is None:
+            lease[0] = self._connect()
+        lease[1] += 1
+        return PooledConnection(self, lease[0])
+
+    def in_transaction(self):
+        """Check if this thread's leased connection has uncommitted work"""
+        lease = getattr(self._local, 'lease', None)
+        return lease is not None and lease[0] is not None and lease[0].in_transaction
+
+    def release(self, conn):
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None and lease[0] is conn:
+            lease[1] -= 1
+            if lease[1] > 0:
+                return
+            self._local.lease = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if os.getpid() == self._pid and len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path):
+    """Get the shared connection pool for a database file"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path)
+        return pool
 
 class Database:
+    # Secondary indexes for the hot query paths: (name, table, columns)
+    INDEXES = [
+        ('idx_attendance_class_date', 'attendance', 'class_id, date'),
+        ('idx_attendance_date_status', 'attendance', 'date, status'),
+        ('idx_attendance_daily_summary_date', 'attendance_daily_summary', 'date'),
+        ('idx_users_role', 'users', 'role'),
+        ('idx_class_assignments_user_role', 'class_assignments', 'user_id, role'),
+        ('idx_class_assignments_class_role', 'class_assignments', 'class_id, role'),
+        ('idx_user_activity_created_at', 'user_activity', 'created_at'),
+        ('idx_user_activity_user_created', 'user_activity', 'user_id, created_at'),
+        ('idx_user_activity_hourly_hour', 'user_activity_hourly', 'hour'),
+        ('idx_face_embeddings_model_user', 'face_embeddings', 'model_name, user_id'),
+        ('idx_temporary_attendance_session', 'temporary_attendance', 'session_id'),
+        ('idx_unrecognized_faces_session', 'unrecognized_faces', 'session_id'),
+    ]
+
     def __init__(self, db_path='attendance.db'):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
     
     def get_db(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.pool.acquire()
+
+    @contextmanager
+    def transaction(self):
+        """Yield a connection and commit on success, roll back on error"""
+        conn = self.get_db()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def enable_write_queue(self):
+        """Route execute_write() through a single background writer for this database"""
+        return self.pool.enable_write_queue()
+
+    def execute_write(self, sql, params=()):
+        """Run one write statement and commit it; returns the lastrowid"""
+        return self.run_write(lambda conn: conn.execute(sql, params).lastrowid)
+
+    def run_write(self, work):
+        """Run work(conn) as one atomic write and commit it; returns work's result"""
+        writer = self.pool.writer
+        # The writer would wait on this thread's own open transaction until
+        # busy_timeout, so such work runs here and commits with it
+        if writer is not None and not self.pool.in_transaction():
+            return writer.submit_work(work).result()
+        with self.transaction() as conn:
+            return work(conn)
+
+    def init_app(self, app):
+        """Pin one pooled connection to each Flask request"""
+        from flask import g
+
+        @app.before_request
+        def _acquire_request_connection():
+            g._db_connection = self.get_db()
+
+        @app.teardown_request
+        def _release_request_connection(exc):
+            conn = g.pop('_db_connection', None)
+            if conn is not None:
+                conn.close()
     
     def migrate_database(self):
         """Safely migrate existing database to new schema"""
@@ -100,12 +370,25 @@ class Database:
                         user_id INTEGER NOT NULL,
                         pose TEXT NOT NULL, -- front, left, right, up, down
                         model_name TEXT NOT NULL, -- Facenet, ArcFace, etc.
-                        embedding TEXT NOT NULL, -- JSON or comma-separated vector
+                        embedding BLOB NOT NULL, -- header + raw float32 vector
+                        pipeline TEXT, -- how the vector was computed; NULL for legacy DeepFace.represent rows
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         UNIQUE(user_id, pose, model_name),
                         FOREIGN KEY (user_id) REFERENCES users (id)
                     )
                 ''')
+            else:
+                self._migrate_embeddings_to_blob(cursor)
+                cursor.execute("PRAGMA table_info(face_embeddings)")
+                if 'pipeline' not in {column[1] for column in cursor.fetchall()}:
+                    # Existing vectors came from DeepFace.represent and are not
+                    # comparable with detector-crop ones; NULL marks them legacy
+                    print("Adding 'pipeline' column to face_embeddings table...")
+                    cursor.execute('ALTER TABLE face_embeddings ADD COLUMN pipeline TEXT')
+                cursor.execute('SELECT COUNT(1) FROM face_embeddings WHERE pipeline IS NULL')
+                legacy = cursor.fetchone()[0]
+                if legacy:
+                    print(f"{legacy} legacy face embeddings are skipped by matching until re-enrolled or backfilled")
             
             # Check if user_activity table exists
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_activity'")
@@ -125,6 +408,71 @@ class Database:
                     )
                 ''')
             
+            # Write counters that tell each process's in-memory caches to reload
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS cache_generations (
+                    name TEXT PRIMARY KEY,
+                    generation INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            
+            # Hourly per-user rollup of user_activity, kept up to date by UserActivity.
+            # Created only here (not in init_db) so existing history is backfilled once.
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_activity_hourly'")
+            if not cursor.fetchone():
+                print("Creating user_activity_hourly table...")
+                cursor.execute('''
+                    CREATE TABLE user_activity_hourly (
+                        user_id INTEGER NOT NULL,
+                        hour TEXT NOT NULL, -- 'YYYY-MM-DD HH:00:00' (UTC)
+                        activity_count INTEGER NOT NULL DEFAULT 0,
+                        last_activity TIMESTAMP,
+                        PRIMARY KEY (user_id, hour)
+                    )
+                ''')
+                cursor.execute('''
+                    INSERT INTO user_activity_hourly (user_id, hour, activity_count, last_activity)
+                    SELECT user_id, strftime('%Y-%m-%d %H:00:00', created_at), COUNT(*), MAX(created_at)
+                    FROM user_activity
+                    GROUP BY user_id, strftime('%Y-%m-%d %H:00:00', created_at)
+                ''')
+            
+            # Per-class daily attendance counts, kept up to date by Attendance.
+            # Created only here (not in init_db) so existing attendance is backfilled once.
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='attendance_daily_summary'")
+            if not cursor.fetchone():
+                print("Creating attendance_daily_summary table...")
+                cursor.execute('''
+                    CREATE TABLE attendance_daily_summary (
+                        class_id INTEGER NOT NULL,
+                        date DATE NOT NULL,
+                        present INTEGER NOT NULL DEFAULT 0,
+                        absent INTEGER NOT NULL DEFAULT 0,
+                        late INTEGER NOT NULL DEFAULT 0,
+                        total INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (class_id, date)
+                    )
+                ''')
+                cursor.execute('''
+                    INSERT INTO attendance_daily_summary (class_id, date, present, absent, late, total)
+                    SELECT class_id, date,
+                           SUM(status = 'present'), SUM(status = 'absent'), SUM(status = 'late'), COUNT(*)
+                    FROM attendance
+                    GROUP BY class_id, date
+                ''')
+            
+            # One temporary_attendance row per student and session, so marks upsert
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_temporary_attendance_session_student'")
+            if not cursor.fetchone():
+                print("Creating unique index idx_temporary_attendance_session_student...")
+                # Earlier marks could insert duplicates; keep the newest of each
+                cursor.execute('''
+                    DELETE FROM temporary_attendance WHERE id NOT IN (
+                        SELECT MAX(id) FROM temporary_attendance GROUP BY session_id, student_id
+                    )
+                ''')
+                cursor.execute('CREATE UNIQUE INDEX idx_temporary_attendance_session_student ON temporary_attendance (session_id, student_id)')
+            
             # Check if class_requests table exists
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='class_requests'")
             if not cursor.fetchone():
@@ -144,6 +492,8 @@ class Database:
                     )
                 ''')
             
+            self._ensure_indexes(cursor)
+            
             conn.commit()
             print("Database migration completed successfully!")
             
@@ -153,6 +503,83 @@ class Database:
         finally:
             conn.close()
     
+    def _ensure_indexes(self, cursor):
+        """Create any missing index from INDEXES on tables that exist"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = {row[0] for row in cursor.fetchall()}
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        existing = {row[0] for row in cursor.fetchall()}
+        for name, table, columns in self.INDEXES:
+            if name not in existing and table in tables:
+                print(f"Creating index {name}...")
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+    def explain_query_plan(self, sql, params=()):
+        """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+        conn = self.get_db()
+        cursor = conn.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = [row['detail'] for row in cursor.fetchall()]
+        conn.close()
+        return plan
+
+    def _migrate_embeddings_to_blob(self, cursor):
+        """Rebuild face_embeddings with a BLOB column and convert JSON text vectors to binary"""
+        cursor.execute("PRAGMA table_info(face_embeddings)")
+        embedding_type = next((column[2] for column in cursor.fetchall() if column[1] == 'embedding'), '')
+        if embedding_type.upper() == 'BLOB':
+            return
+
+        print("Converting face_embeddings to binary BLOB storage...")
+        cursor.execute('''
+            CREATE TABLE face_embeddings_blob (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                pose TEXT NOT NULL, -- front, left, right, up, down
+                model_name TEXT NOT NULL, -- Facenet, ArcFace, etc.
+                embedding BLOB NOT NULL, -- header + raw float32 vector
+                pipeline TEXT, -- how the vector was computed; NULL for legacy DeepFace.represent rows
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(user_id, pose, model_name),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        cursor.execute('SELECT id, user_id, pose, model_name, embedding, created_at FROM face_embeddings')
+        converted = []
+        unreadable = []
+        for row in cursor.fetchall():
+            embedding = row['embedding']
+            if not is_encoded(embedding):
+                try:
+                    embedding = encode_embedding(decode_embedding(embedding))
+                except Exception as e:
+                    print(f"Moving unreadable embedding {row['id']} to face_embeddings_unreadable: {e}")
+                    unreadable.append(tuple(row))
+                    continue
+            converted.append((row['id'], row['user_id'], row['pose'], row['model_name'], embedding, row['created_at']))
+        cursor.executemany('''
+            INSERT INTO face_embeddings_blob (id, user_id, pose, model_name, embedding, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', converted)
+        if unreadable:
+            # Keep the original values, untouched, for manual recovery
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS face_embeddings_unreadable (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    pose TEXT,
+                    model_name TEXT,
+                    embedding,
+                    created_at TIMESTAMP
+                )
+            ''')
+            cursor.executemany('''
+                INSERT OR REPLACE INTO face_embeddings_unreadable (id, user_id, pose, model_name, embedding, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', unreadable)
+        cursor.execute('DROP TABLE face_embeddings')
+        cursor.execute('ALTER TABLE face_embeddings_blob RENAME TO face_embeddings')
+    
     def init_db(self):
         conn = self.get_db()
         cursor = conn.cursor()
@@ -213,7 +640,8 @@ class Database:
                 user_id INTEGER NOT NULL,
                 pose TEXT NOT NULL, -- front, left, right, up, down
                 model_name TEXT NOT NULL, -- Facenet, ArcFace, etc.
-                embedding TEXT NOT NULL, -- JSON or comma-separated vector
+                embedding BLOB NOT NULL, -- header + raw float32 vector
+                pipeline TEXT, -- how the vector was computed; NULL for legacy DeepFace.represent rows
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(user_id, pose, model_name),
                 FOREIGN KEY (user_id) REFERENCES users (id)
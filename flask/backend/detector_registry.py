@@ -0,0 +1,60 @@
+import os
+import threading
+from contextlib import contextmanager
+import cv2
+
+# Instances built per detector; OpenCV detectors keep scratch state between
+# calls, so each instance runs one detection at a time
+DETECTOR_POOL_SIZE = int(os.environ.get('DETECTOR_POOL_SIZE', 2))
+
+_factories = {}
+_idle = {}
+_built = {}
+_available = threading.Condition()
+
+def register_detector(name, factory):
+    """Register a zero-argument factory that builds a detector (cascade, DNN net, ...)"""
+    _factories[name] = factory
+
+@contextmanager
+def use_detector(name):
+    """Borrow a loaded detector from the process-wide pool for one detection"""
+    with _available:
+        if name not in _factories:
+            raise KeyError(f"Unknown detector: {name}")
+        idle = _idle.setdefault(name, [])
+        while not idle and _built.get(name, 0) >= DETECTOR_POOL_SIZE:
+            _available.wait()
+        detector = idle.pop() if idle else None
+        if detector is None:
+            _built[name] = _built.get(name, 0) + 1
+    if detector is None:
+        try:
+            detector = _factories[name]()
+        except Exception:
+            with _available:
+                _built[name] -= 1
+                _available.notify()
+            raise
+    try:
+        yield detector
+    finally:
+        with _available:
+            _idle.setdefault(name, []).append(detector)
+            _available.notify()
+
+def clear_detectors():
+    """Forget every built detector; the next use_detector() builds again"""
+    with _available:
+        _idle.clear()
+        _built.clear()
+
+def load_cascade(filename):
+    """Load a Haar cascade bundled with OpenCV"""
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + filename)
+    if cascade.empty():
+        raise IOError(f"Could not load Haar cascade: {filename}")
+    return cascade
+
+register_detector('haar_face', lambda: load_cascade('haarcascade_frontalface_default.xml'))
+register_detector('haar_eye', lambda: load_cascade('haarcascade_eye.xml'))
@@ -0,0 +1,35 @@
+import json
+import struct
+import numpy as np
+
+# Header: magic, format version, numpy dtype char, vector dimension.
+# Padded to 16 bytes so the float32 payload stays aligned for np.frombuffer.
+MAGIC = b'FEMB'
+VERSION = 1
+HEADER = struct.Struct('<4sBc2xI4x')
+
+def encode_embedding(vector, dtype=np.float32):
+    """Pack an embedding into a BLOB: 16-byte header followed by raw little-endian values"""
+    array = np.ascontiguousarray(vector, dtype=np.dtype(dtype).newbyteorder('<')).ravel()
+    header = HEADER.pack(MAGIC, VERSION, array.dtype.char.encode('ascii'), array.shape[0])
+    return header + array.tobytes()
+
+def is_encoded(value):
+    """Check if a stored embedding value already uses the binary format"""
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:4]) == MAGIC
+
+def decode_embedding(value):
+    """Read a stored embedding as a 1-D numpy array.
+
+    Binary values are read with np.frombuffer (no copy, read-only array);
+    legacy JSON text rows are still accepted so reads work before migration.
+    """
+    if is_encoded(value):
+        magic, version, dtype_char, dim = HEADER.unpack_from(value)
+        if version != VERSION:
+            raise ValueError(f"Unsupported embedding format version: {version}")
+        dtype = np.dtype(dtype_char.decode('ascii')).newbyteorder('<')
+        return np.frombuffer(value, dtype=dtype, count=dim, offset=HEADER.size)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value).decode('utf-8')
+    return np.asarray(json.loads(value), dtype=np.float32)
@@ -0,0 +1,281 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from .models import FaceEmbedding, CacheGeneration
+from .embedding_codec import decode_embedding
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Per-class matrix cache limits
+CLASS_CACHE_MAX_ENTRIES = int(os.environ.get('CLASS_EMBEDDING_CACHE_ENTRIES', 64))
+CLASS_CACHE_MAX_BYTES = int(os.environ.get('CLASS_EMBEDDING_CACHE_MB', 64)) * 1024 * 1024
+# Database write counters a cached class matrix depends on
+SHARED_GENERATIONS = ('face_embeddings', 'class_roster')
+
+def get_embedding_index(db, model_name):
+    """Get the process-wide embedding index for a database and model"""
+    key = (db.db_path, model_name)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = EmbeddingIndex(db, model_name)
+            _indexes[key] = index
+        return index
+
+def normalize(vector):
+    """Return a float32 L2-normalised copy of a vector (or rows of a matrix)"""
+    array = np.asarray(vector, dtype=np.float32)
+    norms = np.linalg.norm(array, axis=-1, keepdims=True)
+    return array / np.maximum(norms, 1e-8)
+
+def search_rows(matrix, ids, poses, query, top_k=1, user_ids=None):
+    """Score a normalised query against rows sorted by user_id; best pose per user.
+
+    Returns up to top_k dicts of user_id, pose and cosine distance, closest first.
+    """
+    if not len(ids) or matrix.shape[1] != query.shape[0]:
+        return []
+    rows = None
+    if user_ids is not None:
+        rows = np.flatnonzero(np.isin(ids, np.asarray(list(user_ids), dtype=np.int64)))
+        if not len(rows):
+            return []
+        matrix = matrix[rows]
+        ids = ids[rows]
+
+    similarities = matrix @ query
+    # Rows are sorted by user_id, so each user is one contiguous run
+    unique_ids, starts = np.unique(ids, return_index=True)
+    best = np.maximum.reduceat(similarities, starts)
+
+    k = min(top_k, len(unique_ids))
+    if k < len(unique_ids):
+        top = np.argpartition(-best, k - 1)[:k]
+    else:
+        top = np.arange(len(unique_ids))
+    top = top[np.argsort(-best[top])]
+
+    results = []
+    ends = np.append(starts[1:], len(ids))
+    for u in top:
+        local = starts[u] + int(np.argmax(similarities[starts[u]:ends[u]]))
+        row = int(rows[local]) if rows is not None else local
+        results.append({
+            'user_id': int(unique_ids[u]),
+            'pose': poses[row],
+            'distance': 1.0 - float(best[u])
+        })
+    return results
+
+def _stack_rows(rows):
+    """Decode (user_id, pose, embedding) rows into sorted ids, poses and a normalised matrix"""
+    user_ids, poses, vectors = [], [], []
+    for row in rows:
+        try:
+            vector = decode_embedding(row['embedding'])
+        except Exception:
+            continue
+        user_ids.append(row['user_id'])
+        poses.append(row['pose'])
+        vectors.append(vector)
+    if vectors:
+        matrix = np.ascontiguousarray(normalize(np.vstack(vectors)))
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    return np.asarray(user_ids, dtype=np.int64), poses, matrix
+
+class EmbeddingIndex:
+    """Resident matrix of every stored embedding for one model.
+
+    Rows are L2-normalised float32 vectors kept sorted by user_id, so a
+    query is one matrix-vector product followed by a per-user max over poses.
+    Each query first reads the shared face_embeddings generation and reloads
+    the matrix if another process has stored embeddings since it was built.
+    """
+
+    def __init__(self, db, model_name):
+        self.db = db
+        self.model_name = model_name
+        self.embedding_model = FaceEmbedding(db)
+        self.generations = CacheGeneration(db)
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._generation = None
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._poses = []
+
+    def load(self):
+        """(Re)build the matrix from the face_embeddings table"""
+        with self._lock:
+            # Read before the rows, so a write landing mid-load triggers another reload
+            generation = self.generations.get('face_embeddings')
+            rows = self.embedding_model.get_all_embeddings(self.model_name)
+            self._user_ids, self._poses, self._matrix = _stack_rows(rows)
+            self._generation = generation
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        generation = self.generations.get('face_embeddings')
+        if not self._loaded or generation != self._generation:
+            with self._lock:
+                if not self._loaded or generation != self._generation:
+                    self.load()
+
+    def invalidate(self):
+        """Drop the matrix so the next query reloads it from the database"""
+        with self._lock:
+            self._loaded = False
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._poses)
+
+    def contains(self, user_id):
+        """Check if any embedding is indexed for a user"""
+        self._ensure_loaded()
+        with self._lock:
+            pos = np.searchsorted(self._user_ids, user_id)
+            return bool(pos < len(self._user_ids) and self._user_ids[pos] == user_id)
+
+    def add(self, user_id, pose, vector, generation=None):
+        """Insert or replace the embedding for (user_id, pose) in place.
+
+        generation is the value upsert_embedding returned; when it directly
+        follows the loaded one the matrix stays current without a reload.
+        """
+        row = normalize(vector)
+        with self._lock:
+            if not self._loaded:
+                # Nothing resident yet; the next query loads it from the database
+                return
+            if generation is not None:
+                if self._generation is None or generation != self._generation + 1:
+                    # Other writes happened in between; reload instead
+                    self._loaded = False
+                    return
+                self._generation = generation
+            if self._matrix.size and self._matrix.shape[1] != row.shape[0]:
+                self._loaded = False
+                return
+            start = np.searchsorted(self._user_ids, user_id, side='left')
+            end = np.searchsorted(self._user_ids, user_id, side='right')
+            for i in range(start, end):
+                if self._poses[i] == pose:
+                    self._matrix[i] = row
+                    return
+            if self._matrix.size:
+                self._matrix = np.insert(self._matrix, end, row, axis=0)
+            else:
+                self._matrix = row.reshape(1, -1).copy()
+            self._user_ids = np.insert(self._user_ids, end, user_id)
+            self._poses.insert(end, pose)
+
+    def search(self, vector, top_k=1, user_ids=None):
+        """Return the top_k closest users as dicts of user_id, pose and cosine distance.
+
+        Each user is scored by their best-matching pose. Pass user_ids to
+        restrict the search to a candidate set (e.g. one class roster).
+        """
+        self._ensure_loaded()
+        query = normalize(vector)
+        with self._lock:
+            return self._search_locked(query, top_k, user_ids)
+
+    def _search_locked(self, query, top_k, user_ids):
+        return search_rows(self._matrix, self._user_ids, self._poses, query, top_k, user_ids)
+
+class ClassEmbeddings:
+    """Stacked normalised embeddings of one class's students for one model"""
+
+    def __init__(self, class_id, model_name, student_ids, user_ids, poses, matrix, generations=None):
+        self.class_id = class_id
+        self.model_name = model_name
+        # Whole roster, including students with no embeddings yet
+        self.student_ids = frozenset(student_ids)
+        self.user_ids = user_ids
+        self.poses = poses
+        self.matrix = matrix
+        # Shared (face_embeddings, class_roster) counters this was loaded at
+        self.generations = generations
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.user_ids.nbytes
+
+    def search(self, vector, top_k=1):
+        """Return the top_k closest students, as in EmbeddingIndex.search"""
+        return search_rows(self.matrix, self.user_ids, self.poses, normalize(vector), top_k)
+
+class ClassEmbeddingCache:
+    """LRU cache of ClassEmbeddings keyed by (database, class_id, model_name).
+
+    Bounded by entry count and total matrix bytes. The models drop entries when
+    a class's roster or one of its students' embeddings changes, so a live
+    session reads embeddings from SQLite only once. Writes made by other
+    processes are caught by the shared face_embeddings and class_roster
+    generations, which every lookup compares with the entry's.
+    """
+
+    def __init__(self, max_entries=CLASS_CACHE_MAX_ENTRIES, max_bytes=CLASS_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, db, class_id, model_name):
+        """Get a class's embeddings, loading them from the database on a miss"""
+        key = (db.db_path, int(class_id), model_name)
+        generations = CacheGeneration(db).get_all(SHARED_GENERATIONS)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.generations == generations:
+                self._entries.move_to_end(key)
+                return entry
+            generation = self._generation
+
+        rows = FaceEmbedding(db).get_class_embeddings(class_id, model_name)
+        student_ids = {row['user_id'] for row in rows}
+        user_ids, poses, matrix = _stack_rows(row for row in rows if row['embedding'] is not None)
+        entry = ClassEmbeddings(int(class_id), model_name, student_ids, user_ids, poses, matrix, generations)
+
+        with self._lock:
+            # An invalidation during the load may have made these rows stale
+            if generation == self._generation and entry.nbytes <= self.max_bytes:
+                self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._entries[key] = entry
+        self._bytes += entry.nbytes
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def invalidate(self, class_id=None, user_id=None):
+        """Drop a class's entries, or those of every class with user_id on its roster"""
+        with self._lock:
+            self._generation += 1
+            for key, entry in list(self._entries.items()):
+                if (class_id is not None and key[1] == int(class_id)) or \
+                        (user_id is not None and int(user_id) in entry.student_ids):
+                    del self._entries[key]
+                    self._bytes -= entry.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+class_embedding_cache = ClassEmbeddingCache()
@@ -1,20 +1,124 @@
 import cv2
 import numpy as np
-from deepface import DeepFace
+from deepface.modules import preprocessing
 from .database import Database
 from .models import FaceEmbedding
-import json
+from .embedding_index import get_embedding_index, class_embedding_cache
+from .model_registry import get_model, COSINE_THRESHOLDS
+from .detector_registry import use_detector, register_detector
+from .frames import DecodedFrame
 import os
 from datetime import datetime
-import base64
-from PIL import Image
-import io
+
+class FaceDetector:
+    """Base face detector: downscales large frames, detects, and maps boxes back.
+    
+    Subclasses implement _detect(image_bgr) returning (x, y, w, h) boxes in the
+    coordinates of the image they were given.
+    """
+    
+    def __init__(self, max_side=640):
+        self.max_side = max_side
+    
+    def detect(self, image):
+        """Detect faces and return (x, y, w, h) boxes in original image coordinates"""
+        height, width = image.shape[:2]
+        scale = 1.0
+        if self.max_side and max(height, width) > self.max_side:
+            scale = self.max_side / max(height, width)
+            image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        boxes = []
+        for (x, y, w, h) in self._detect(image):
+            x, y, w, h = (int(round(v / scale)) for v in (x, y, w, h))
+            # Clip to the frame; DNN detectors can return boxes past the edge
+            x2, y2 = min(x + w, width), min(y + h, height)
+            x, y = max(0, x), max(0, y)
+            w, h = x2 - x, y2 - y
+            if w > 0 and h > 0:
+                boxes.append((x, y, w, h))
+        return boxes
+    
+    def _detect(self, image):
+        raise NotImplementedError
+
+class HaarFaceDetector(FaceDetector):
+    """OpenCV Haar cascade (frontal faces only, no model files needed)"""
+    
+    def __init__(self, scale_factor=1.3, min_neighbors=5, max_side=640):
+        super().__init__(max_side)
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+    
+    def _detect(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        with use_detector('haar_face') as cascade:
+            return cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors)
+
+class SsdFaceDetector(FaceDetector):
+    """OpenCV DNN res10 300x300 SSD (Caffe); handles non-frontal faces on CPU"""
+    
+    def __init__(self, prototxt, caffemodel, confidence=0.5, max_side=640):
+        super().__init__(max_side)
+        self.confidence = confidence
+        self.detector_name = f'ssd:{caffemodel}'
+        register_detector(self.detector_name, lambda: cv2.dnn.readNetFromCaffe(prototxt, caffemodel))
+    
+    def _detect(self, image):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+        with use_detector(self.detector_name) as net:
+            net.setInput(blob)
+            detections = net.forward()[0, 0]
+        boxes = []
+        for detection in detections[detections[:, 2] >= self.confidence]:
+            x1, y1, x2, y2 = detection[3:7] * np.array([width, height, width, height])
+            boxes.append((x1, y1, x2 - x1, y2 - y1))
+        return boxes
+
+class YuNetFaceDetector(FaceDetector):
+    """OpenCV YuNet (cv2.FaceDetectorYN, ONNX model); fast CPU detector"""
+    
+    def __init__(self, model_path, score_threshold=0.6, max_side=640):
+        super().__init__(max_side)
+        self.detector_name = f'yunet:{model_path}'
+        register_detector(self.detector_name, lambda: cv2.FaceDetectorYN.create(model_path, '', (320, 320), score_threshold))
+    
+    def _detect(self, image):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        with use_detector(self.detector_name) as detector:
+            detector.setInputSize((width, height))
+            _, faces = detector.detect(image)
+        if faces is None:
+            return []
+        return [tuple(face[:4]) for face in faces]
+
+def create_face_detector(backend=None):
+    """Build the face detector for this deployment.
+    
+    backend defaults to the FACE_DETECTOR environment variable: 'haar'
+    (default), 'ssd' (FACE_DETECTOR_CONFIG prototxt + FACE_DETECTOR_MODEL
+    caffemodel) or 'yunet' (FACE_DETECTOR_MODEL onnx). FACE_DETECTOR_MAX_SIDE
+    sets the size frames are downscaled to before detection (0 disables).
+    """
+    backend = (backend or os.environ.get('FACE_DETECTOR', 'haar')).lower()
+    max_side = int(os.environ.get('FACE_DETECTOR_MAX_SIDE', 640))
+    if backend == 'ssd':
+        return SsdFaceDetector(os.environ['FACE_DETECTOR_CONFIG'], os.environ['FACE_DETECTOR_MODEL'], max_side=max_side)
+    if backend == 'yunet':
+        return YuNetFaceDetector(os.environ['FACE_DETECTOR_MODEL'], max_side=max_side)
+    if backend == 'haar':
+        return HaarFaceDetector(max_side=max_side)
+    raise ValueError(f"Unknown face detector backend: {backend}")
 
 class FaceRecognition:
-    def __init__(self, faces_dir='faces', model_name='Facenet'):
+    def __init__(self, faces_dir='faces', model_name='Facenet', detector=None):
         self.faces_dir = faces_dir
         self.model_name = model_name  # e.g., 'Facenet', 'ArcFace', 'VGG-Face'
-        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.detector = detector or create_face_detector()
         self.db = Database()
         self.embedding_model = FaceEmbedding(self.db)
         
@@ -25,50 +129,170 @@ class FaceRecognition:
     def set_model(self, model_name):
         self.model_name = model_name
 
-    def compute_embedding_from_image(self, image_bgr):
-        # DeepFace.represent expects RGB
-        image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-        reps = DeepFace.represent(img_path=image_rgb, enforce_detection=False, model_name=self.model_name)
-        if isinstance(reps, list) and len(reps) > 0:
-            vector = reps[0]['embedding'] if isinstance(reps[0], dict) and 'embedding' in reps[0] else reps[0]
-            return vector
-        return None
+    @property
+    def index(self):
+        """Resident embedding index for the current model"""
+        return get_embedding_index(self.db, self.model_name)
+
+    def compute_embedding_from_image(self, image, box=None):
+        """Embed the main face of a BGR image or DecodedFrame.
+        
+        Pass box (x, y, w, h) to embed an already-detected face directly;
+        otherwise the largest detected face is used (the whole frame if none
+        is found). Either way the vector comes from the same detect, crop and
+        _embed_faces pipeline as live recognition.
+        """
+        frame = DecodedFrame.wrap(image)
+        if box is None:
+            faces = self.detect_faces(frame.bgr)
+            if not faces:
+                return self._embed_faces([frame.bgr])[0]
+            box = max(faces, key=lambda face: face[2] * face[3])
+        x, y, w, h = box
+        crop = frame.bgr[y:y+h, x:x+w]
+        return self._embed_faces([crop])[0] if crop.size else None
+
+    def detect_faces(self, image_bgr):
+        """Detect all faces in a frame as (x, y, w, h) boxes"""
+        return self.detector.detect(image_bgr)
+
+    def _face_tensor(self, face_bgr, target_size):
+        # DeepFace's letterbox resize and 'base' normalisation; its models take
+        # BGR input (represent() flips extracted faces back to BGR), so the
+        # OpenCV crop is passed through as is
+        face = preprocessing.resize_image(img=face_bgr, target_size=(target_size[1], target_size[0]))
+        return preprocessing.normalize_input(img=face, normalization='base')
+
+    def _embed_faces(self, faces_bgr, batch_size=32):
+        """Run face crops through the model in batches of up to batch_size"""
+        model = get_model(self.model_name)
+        vectors = []
+        for start in range(0, len(faces_bgr), batch_size):
+            chunk = faces_bgr[start:start + batch_size]
+            batch = np.concatenate([self._face_tensor(face, model.input_shape) for face in chunk], axis=0)
+            output = np.asarray(model.forward(batch), dtype=np.float32)
+            vectors.extend(output.reshape(len(chunk), -1))
+        return vectors
+
+    def compute_face_embeddings(self, image_bgr, boxes=None, batch_size=32):
+        """Embed every face in a frame with one batched forward pass.
+        
+        Returns a list of {'box': (x, y, w, h), 'embedding': vector}. Pass boxes
+        to reuse detections that were already made on this frame.
+        """
+        if boxes is None:
+            boxes = self.detect_faces(image_bgr)
+        faces = [(tuple(box), image_bgr[box[1]:box[1]+box[3], box[0]:box[0]+box[2]]) for box in boxes]
+        faces = [(box, crop) for box, crop in faces if crop.size]
+        if not faces:
+            return []
+        vectors = self._embed_faces([crop for _, crop in faces], batch_size)
+        return [{'box': box, 'embedding': vector} for (box, _), vector in zip(faces, vectors)]
+
+    def compute_embeddings_batch(self, images, batch_size=32):
+        """Embed the largest face of each image (the whole image if none is found) in batches"""
+        faces = []
+        for image_bgr in images:
+            boxes = self.detect_faces(image_bgr)
+            if boxes:
+                x, y, w, h = max(boxes, key=lambda box: box[2] * box[3])
+                faces.append(image_bgr[y:y+h, x:x+w])
+            else:
+                faces.append(image_bgr)
+        if not faces:
+            return []
+        return self._embed_faces(faces, batch_size)
 
     def store_embedding(self, user_id, pose, vector):
-        embedding_text = json.dumps(vector)
-        self.embedding_model.upsert_embedding(user_id, pose, self.model_name, embedding_text)
+        generation = self.embedding_model.upsert_embedding(user_id, pose, self.model_name, vector)
+        self.index.add(user_id, pose, vector, generation)
         return True
 
     def get_user_embeddings(self, user_id):
-        rows = self.embedding_model.get_user_embeddings(user_id, self.model_name)
-        embeddings_by_pose = {}
-        for row in rows:
-            try:
-                embeddings_by_pose[row['pose']] = json.loads(row['embedding'])
-            except Exception:
-                pass
-        return embeddings_by_pose
+        try:
+            rows = self.embedding_model.get_user_embeddings(user_id, self.model_name)
+        except Exception:
+            return {}
+        return {row['pose']: row['embedding'] for row in rows if row['pipeline'] == FaceEmbedding.PIPELINE}
+
+    def identify(self, vector, top_k=1, user_ids=None):
+        """Find the closest enrolled users to an embedding (1:N), optionally within a candidate set"""
+        return self.index.search(vector, top_k=top_k, user_ids=user_ids)
+
+    def class_embeddings(self, class_id):
+        """Cached embedding matrix of a class's students for the current model"""
+        return class_embedding_cache.get(self.db, class_id, self.model_name)
+
+    def match_face(self, image, class_id=None, user_ids=None, distance_threshold=None):
+        """Identify the main face of a frame within a class roster or a set of candidate users.
+        
+        The frame is detected and embedded once, then scored against the cached
+        class matrix (class_id) or the resident index restricted to user_ids.
+        Returns None if no face is found, else
+        a dict with user_id (None when nobody is within distance_threshold),
+        distance, margin (runner-up distance minus best, None with one
+        candidate) and the face box.
+        """
+        frame = DecodedFrame.wrap(image)
+        faces = self.detector.detect(frame.bgr)
+        if len(faces) == 0:
+            return None
+        # Live frames are cropped around one face; take the largest if several remain
+        box = max(faces, key=lambda face: face[2] * face[3])
+        vector = self.compute_embedding_from_image(frame, box=box)
+        if vector is None:
+            return None
+        
+        if distance_threshold is None:
+            distance_threshold = COSINE_THRESHOLDS.get(self.model_name, 0.40)
+        if class_id is not None:
+            matches = self.class_embeddings(class_id).search(vector, top_k=2)
+        else:
+            matches = self.identify(vector, top_k=2, user_ids=user_ids)
+        best = matches[0] if matches else None
+        return {
+            'user_id': best['user_id'] if best and best['distance'] <= distance_threshold else None,
+            'distance': best['distance'] if best else None,
+            'margin': matches[1]['distance'] - best['distance'] if len(matches) > 1 else None,
+            'box': box
+        }
     
-    def validate_face_quality(self, image, pose=None):
-        """Validate face quality and optionally enforce pose guidance (front/left/right/up/down)."""
+    def assess_face_quality(self, image, pose=None, faces=None):
+        """Check face quality and optionally enforce pose guidance (front/left/right/up/down).
+        
+        image may be a BGR array or a DecodedFrame (whose grayscale view is reused).
+        Pass faces to reuse detections already made on this frame. Returns a dict
+        with valid, message, box (the validated face or None), brightness,
+        contrast and eye_count; the measurements are None when a check stops
+        before reaching them.
+        """
+        result = {
+            'valid': False,
+            'message': '',
+            'box': None,
+            'brightness': None,
+            'contrast': None,
+            'eye_count': None
+        }
         try:
-            # Convert to grayscale for face detection
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image
+            frame = DecodedFrame.wrap(image)
+            image = frame.bgr
             
-            # Detect faces
-            faces = self.cascade.detectMultiScale(gray, 1.3, 5)
+            # Detect faces unless the caller already did
+            if faces is None:
+                faces = self.detector.detect(image)
             
             if len(faces) == 0:
-                return False, "No face detected. Please ensure your full face is visible."
+                result['message'] = "No face detected. Please ensure your full face is visible."
+                return result
             
             if len(faces) > 1:
-                return False, "Multiple faces detected. Please ensure only your face is visible."
+                result['message'] = "Multiple faces detected. Please ensure only your face is visible."
+                return result
             
             # Get the face region
-            (x, y, w, h) = faces[0]
+            (x, y, w, h) = (int(v) for v in faces[0])
+            result['box'] = (x, y, w, h)
             
             # Check face size (should be reasonably large)
             face_area = w * h
@@ -76,10 +300,12 @@ class FaceRecognition:
             face_ratio = face_area / image_area
             
             if face_ratio < 0.05:  # Face too small
-                return False, "Face too small. Please move closer to the camera."
+                result['message'] = "Face too small. Please move closer to the camera."
+                return result
             
             if face_ratio > 0.8:  # Face too large
-                return False, "Face too close. Please move back from the camera."
+                result['message'] = "Face too close. Please move back from the camera."
+                return result
             
             # Check face position (should be roughly centered)
             center_x = x + w/2
@@ -91,48 +317,68 @@ class FaceRecognition:
             tolerance_x = image.shape[1] * 0.3
             tolerance_y = image.shape[0] * 0.3
             
+            pose_message = None
             if pose in (None, '', 'front'):
                 # For front, require stricter centering
                 if abs(center_x - image_center_x) > tolerance_x * 0.4 or abs(center_y - image_center_y) > tolerance_y * 0.4:
-                    return False, "Center your face inside the circle."
+                    pose_message = "Center your face inside the circle."
             elif pose == 'left':
                 if not (center_x < image_center_x - tolerance_x * 0.15):
-                    return False, "Turn your head slightly left."
+                    pose_message = "Turn your head slightly left."
             elif pose == 'right':
                 if not (center_x > image_center_x + tolerance_x * 0.15):
-                    return False, "Turn your head slightly right."
+                    pose_message = "Turn your head slightly right."
             elif pose == 'up':
                 if not (center_y < image_center_y - tolerance_y * 0.15):
-                    return False, "Tilt your head up."
+                    pose_message = "Tilt your head up."
             elif pose == 'down':
                 if not (center_y > image_center_y + tolerance_y * 0.15):
-                    return False, "Tilt your head down."
+                    pose_message = "Tilt your head down."
+            
+            if pose_message:
+                result['message'] = pose_message
+                return result
             
             # Check lighting (brightness and contrast)
-            face_roi = gray[y:y+h, x:x+w]
-            brightness = np.mean(face_roi)
-            contrast = np.std(face_roi)
+            face_roi = frame.gray[y:y+h, x:x+w]
+            brightness = float(np.mean(face_roi))
+            contrast = float(np.std(face_roi))
+            result['brightness'] = brightness
+            result['contrast'] = contrast
             
             if brightness < 50:
-                return False, "Image too dark. Please improve lighting."
+                result['message'] = "Image too dark. Please improve lighting."
+                return result
             
             if brightness > 200:
-                return False, "Image too bright. Please reduce lighting."
+                result['message'] = "Image too bright. Please reduce lighting."
+                return result
             
             if contrast < 20:
-                return False, "Low contrast. Please improve lighting conditions."
+                result['message'] = "Low contrast. Please improve lighting conditions."
+                return result
             
             # Check if eyes are visible (rough estimate)
-            eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-            eyes = eye_cascade.detectMultiScale(face_roi, 1.1, 3)
+            with use_detector('haar_eye') as cascade:
+                eyes = cascade.detectMultiScale(face_roi, 1.1, 3)
+            result['eye_count'] = len(eyes)
             
             if len(eyes) < 1:
-                return False, "Eyes not clearly visible. Please remove glasses or improve lighting."
+                result['message'] = "Eyes not clearly visible. Please remove glasses or improve lighting."
+                return result
             
-            return True, "Face quality is good"
+            result['valid'] = True
+            result['message'] = "Face quality is good"
+            return result
             
         except Exception as e:
-            return False, f"Error validating face quality: {str(e)}"
+            result['message'] = f"Error validating face quality: {str(e)}"
+            return result
+    
+    def validate_face_quality(self, image, pose=None, faces=None):
+        """Validate face quality; returns (is_valid, message)"""
+        quality = self.assess_face_quality(image, pose, faces)
+        return quality['valid'], quality['message']
     
     def capture_face_from_camera(self, user_id):
         """Capture face from camera with quality validation"""
@@ -162,21 +408,22 @@ class FaceRecognition:
             display_frame = frame.copy()
             
             # Detect faces
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.cascade.detectMultiScale(gray, 1.3, 5)
+            faces = self.detector.detect(frame)
+            
+            # Validate once per frame, reusing the detections above
+            is_valid, message = self.validate_face_quality(frame, faces=faces)
             
             # Draw face detection rectangle and quality indicators
-            for (x, y, w, h) in faces:
-                # Validate face quality
-                is_valid, message = self.validate_face_quality(frame)
+            if len(faces) > 0:
+                color = (0, 255, 0) if is_valid else (0, 0, 255)
+                for (x, y, w, h) in faces:
+                    cv2.rectangle(display_frame, (x, y), (x+w, y+h), color, 2)
                 
                 if is_valid:
-                    cv2.rectangle(display_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
                     cv2.putText(display_frame, 'Face OK - Press SPACE to capture', (10, 30), 
                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
                     quality_message = "Face quality is good"
                 else:
-                    cv2.rectangle(display_frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
                     cv2.putText(display_frame, 'Face Quality Issue', (10, 30), 
                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
                     quality_message = message
@@ -200,7 +447,6 @@ class FaceRecognition:
                 break
             elif key == ord(' '):  # Space bar to capture
                 if len(faces) > 0:
-                    is_valid, message = self.validate_face_quality(frame)
                     if is_valid:
                         face_path = os.path.join(self.faces_dir, f'user_{user_id}.jpg')
                         cv2.imwrite(face_path, frame)
@@ -222,32 +468,23 @@ class FaceRecognition:
     def capture_face_from_upload(self, user_id, image_data, pose='front', persist_image=True):
         """Capture face from uploaded image with quality validation"""
         try:
-            # Decode base64 image data
-            if image_data.startswith('data:image'):
-                # Remove data URL prefix
-                image_data = image_data.split(',')[1]
-            
-            # Decode base64
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Convert to OpenCV format
-            opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+            # Decode once; the same frame is shared by validation and embedding
+            frame = image_data if isinstance(image_data, DecodedFrame) else DecodedFrame.from_base64(image_data)
             
             # Validate face quality
-            is_valid, message = self.validate_face_quality(opencv_image)
+            quality = self.assess_face_quality(frame)
             
-            if not is_valid:
-                return False, message
+            if not quality['valid']:
+                return False, quality['message']
             
             # Optionally save the image
             face_path = None
             if persist_image:
                 face_path = os.path.join(self.faces_dir, f'user_{user_id}.jpg')
-                cv2.imwrite(face_path, opencv_image)
+                cv2.imwrite(face_path, frame.bgr)
 
             # Compute and store embedding for the specified pose
-            vector = self.compute_embedding_from_image(opencv_image)
+            vector = self.compute_embedding_from_image(frame, box=quality['box'])
             if vector is None:
                 return False, "Failed to compute face embedding"
             self.store_embedding(user_id, pose, vector)
@@ -268,8 +505,7 @@ class FaceRecognition:
     
     def recognize_face(self, user_id, max_attempts=5, distance_threshold=0.9):
         """Recognize using stored embeddings; compare live embedding to user's multi-pose embeddings"""
-        stored = self.get_user_embeddings(user_id)
-        if not stored:
+        if not self.index.contains(user_id):
             return False, "No embeddings found for this user"
         
         cap = cv2.VideoCapture(0)
@@ -291,13 +527,14 @@ class FaceRecognition:
             if not ret:
                 continue
             
-            # Validate face quality first
-            is_valid, message = self.validate_face_quality(frame)
+            # Detect once; validation, embedding and drawing share the boxes
+            faces = self.detector.detect(frame)
+            quality = self.assess_face_quality(frame, faces=faces)
             
-            if not is_valid:
+            if not quality['valid']:
                 # Show the frame with quality message
                 display_frame = frame.copy()
-                cv2.putText(display_frame, f'Quality Issue: {message}', (10, 30), 
+                cv2.putText(display_frame, f'Quality Issue: {quality["message"]}', (10, 30), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
                 cv2.putText(display_frame, f'Attempts: {attempts + 1}/{max_attempts}', (10, 60), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
@@ -307,23 +544,16 @@ class FaceRecognition:
                     break
                 continue
             
-            # Compute live embedding from frame
+            # Compute live embedding from the validated face crop
             try:
-                live_vector = self.compute_embedding_from_image(frame)
+                live_vector = self.compute_embedding_from_image(frame, box=quality['box'])
                 if live_vector is None:
                     attempts += 1
                     continue
 
-                # Compare with all stored pose embeddings
-                min_distance = 999.0
-                for pose_key, stored_vector in stored.items():
-                    # Cosine distance between unit-normalized vectors
-                    a = np.array(live_vector, dtype=np.float32)
-                    b = np.array(stored_vector, dtype=np.float32)
-                    denom = (np.linalg.norm(a) * np.linalg.norm(b)) + 1e-8
-                    dist = 1.0 - float(np.dot(a, b) / denom)
-                    if dist < min_distance:
-                        min_distance = dist
+                # Best cosine distance over all of the user's stored poses
+                matches = self.identify(live_vector, top_k=1, user_ids=[user_id])
+                min_distance = matches[0]['distance'] if matches else 999.0
 
                 if min_distance < distance_threshold:
                     recognition_success = True
@@ -338,11 +568,8 @@ class FaceRecognition:
             
             # Show live feed with status
             display_frame = frame.copy()
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.cascade.detectMultiScale(gray, 1.3, 5)
-            
-            for (x, y, w, h) in faces:
-                cv2.rectangle(display_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+            (x, y, w, h) = quality['box']
+            cv2.rectangle(display_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
             
             cv2.putText(display_frame, f'Attempts: {attempts}/{max_attempts}', (10, 30), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
@@ -377,11 +604,15 @@ class FaceRecognition:
         """Get information about stored embeddings"""
         rows = self.embedding_model.get_user_embeddings(user_id)
         if rows:
-            poses = [row['pose'] for row in rows]
+            poses = [row['pose'] for row in rows if row['pipeline'] == FaceEmbedding.PIPELINE]
+            # Legacy poses are not used for matching until captured again
+            legacy_poses = [row['pose'] for row in rows if row['pipeline'] != FaceEmbedding.PIPELINE]
             return {
                 'exists': True,
                 'model': self.model_name,
                 'poses': poses,
-                'count': len(rows)
+                'legacy_poses': legacy_poses,
+                'needs_reenrollment': bool(legacy_poses),
+                'count': len(poses)
             }
         return {'exists': False}
@@ -0,0 +1,73 @@
+import base64
+import binascii
+import cv2
+import numpy as np
+
+class DecodedFrame:
+    """An image decoded once, with a grayscale view computed on first use.
+
+    Pass the same DecodedFrame through validation, detection and embedding so
+    each request decodes and colour-converts the frame only once.
+    """
+
+    def __init__(self, bgr):
+        self.bgr = bgr
+        self._gray = bgr if bgr.ndim == 2 else None
+
+    @classmethod
+    def wrap(cls, image):
+        """Return image unchanged if it is already a DecodedFrame, else wrap a BGR array"""
+        return image if isinstance(image, cls) else cls(image)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Decode encoded image bytes (JPEG, PNG, ...) straight to BGR with cv2.imdecode"""
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        bgr = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+        if bgr is None:
+            raise ValueError("Could not decode image data")
+        return cls(bgr)
+
+    @classmethod
+    def from_base64(cls, image_data):
+        """Decode a base64 string or data URL (data:image/...;base64,...)"""
+        if image_data.startswith('data:image'):
+            image_data = image_data.split(',', 1)[1]
+        try:
+            data = base64.b64decode(image_data)
+        except (binascii.Error, ValueError):
+            raise ValueError("Invalid base64 image data")
+        return cls.from_bytes(data)
+
+    @classmethod
+    def from_file(cls, path):
+        """Read an image file from disk"""
+        bgr = cv2.imread(path, cv2.IMREAD_COLOR)
+        if bgr is None:
+            raise ValueError(f"Could not read image: {path}")
+        return cls(bgr)
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+def read_image_upload(request, field='image'):
+    """Pull an uploaded image and its parameters out of a Flask request.
+
+    Raw image bodies (pose etc. in the query string) and multipart uploads (file
+    in `field`) are decoded straight from their bytes into a DecodedFrame. JSON
+    bodies keep the older base64 `image_data` string, decoded later by the
+    caller. Returns (image, params); image is None if nothing was sent.
+    """
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        data = request.get_data(cache=False)
+        return (DecodedFrame.from_bytes(data) if data else None), request.args
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get(field)
+        params = request.form.to_dict()
+        params.update((key, value) for key, value in request.args.items() if key not in params)
+        return (DecodedFrame.from_bytes(upload.read()) if upload else None), params
+    data = request.get_json(silent=True) or {}
+    return data.get('image_data'), data
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import queue
+import threading
+from .recognition_pool import get_recognition_pool, RecognitionBusy, StaleFrame
+
+PRESENT_STATUS = 'Present (Temporary)'
+
+# Seconds between keep-alive comments on an idle event stream
+HEARTBEAT_INTERVAL = 15
+# Events buffered per subscriber before the oldest are discarded
+SUBSCRIBER_BUFFER = 100
+# Seconds between a stream's database checks for attendance changes and the
+# session ending; this is how writes made in other worker processes reach it
+POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', 2))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_live_session(session_id, class_id, recognizer, session_service):
+    """Get (or start) the streaming recognition state for an attendance session"""
+    session_id = int(session_id)
+    with _sessions_lock:
+        live = _sessions.get(session_id)
+        if live is None:
+            live = LiveSession(session_id, class_id, recognizer, session_service)
+            _sessions[session_id] = live
+        return live
+
+def notify(session_id, event, data):
+    """Publish an event to a session's streams, if anyone is watching it"""
+    live = _sessions.get(int(session_id))
+    if live is not None:
+        live.publish(event, data)
+
+def close_live_session(session_id):
+    """Stop a session's worker and tell its streams the session has ended"""
+    with _sessions_lock:
+        live = _sessions.pop(int(session_id), None)
+    if live is not None:
+        live.close()
+
+def format_event(event, data):
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _offer(events, message):
+    """Queue a message; a slow client loses its oldest event instead of stalling the sender"""
+    try:
+        events.put_nowait(message)
+    except queue.Full:
+        try:
+            events.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            events.put_nowait(message)
+        except queue.Full:
+            pass
+
+class LiveSession:
+    """Streaming recognition for one attendance session.
+
+    Frames go to the shared recognition pool under this session's key, so a
+    frame that has not been processed yet is replaced (and counted as
+    dropped) rather than queued. Recognised students are marked present in
+    temporary_attendance; recognition and attendance events go to every
+    subscribed event stream in this process.
+
+    State is per process. Under several gunicorn workers the frame POSTs and
+    the event stream can land in different workers, so streams also poll
+    temporary_attendance and the session status every POLL_INTERVAL:
+    attendance changes and the session ending reach every stream, while
+    per-frame 'recognition' events only reach streams in the worker that
+    processed the frame.
+    """
+
+    def __init__(self, session_id, class_id, recognizer, session_service):
+        self.session_id = session_id
+        self.class_id = class_id
+        self.recognizer = recognizer
+        self.session_service = session_service
+        self.pool = get_recognition_pool()
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+        self._closed = False
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        # Students already marked present are not re-marked on every frame,
+        # so a teacher's manual change is not overwritten. Pool workers may
+        # process this session's frames concurrently, so marking is serialized.
+        self._mark_lock = threading.Lock()
+        self._marked = self._present_students()
+
+    @property
+    def pool_key(self):
+        return ('live', self.session_id)
+
+    def submit_frame(self, frame):
+        """Hand the newest frame to the recognition pool.
+
+        Returns False once the session is closed; raises RecognitionBusy when
+        the pool has no room for another session.
+        """
+        if self._closed:
+            return False
+        self.frames_received += 1
+        try:
+            future = self.pool.submit(self.pool_key, self._process, frame)
+        except RecognitionBusy:
+            self.frames_dropped += 1
+            raise
+        future.add_done_callback(self._frame_done)
+        return True
+
+    def _attendance_rows(self):
+        return {record['student_id']: record for record in self.session_service.get_temporary_attendance(self.session_id)}
+
+    def _present_students(self):
+        return {student_id for student_id, record in self._attendance_rows().items() if record['status'] == PRESENT_STATUS}
+
+    def _session_open(self):
+        session_row = self.session_service.get_session(self.session_id)
+        return session_row is not None and session_row['status'] == 'In Progress'
+
+    def _frame_done(self, future):
+        if future.cancelled() or isinstance(future.exception(), StaleFrame):
+            self.frames_dropped += 1
+
+    def stats(self):
+        return {
+            'frames_received': self.frames_received,
+            'frames_dropped': self.frames_dropped,
+            'frames_processed': self.frames_processed,
+            'subscribers': len(self._subscribers)
+        }
+
+    def _process(self, frame):
+        try:
+            match = self.recognizer.match_face(frame, class_id=self.class_id)
+        except Exception as e:
+            self.publish('recognition_error', {'message': f'Recognition error: {str(e)}'})
+            return
+        finally:
+            self.frames_processed += 1
+
+        if match is None:
+            self.publish('recognition', {'face': False})
+            return
+
+        student_id = match['user_id']
+        self.publish('recognition', {
+            'face': True,
+            'student_id': student_id,
+            'distance': match['distance'],
+            'margin': match['margin'],
+            'box': [int(v) for v in match['box']]
+        })
+
+        if student_id is not None:
+            with self._mark_lock:
+                if student_id in self._marked:
+                    return
+                # Another worker process may already have marked them
+                self._marked = self._present_students()
+                if student_id not in self._marked:
+                    # The service publishes the resulting 'attendance' event
+                    self.session_service.mark_temporary_attendance(self.session_id, student_id, PRESENT_STATUS, True)
+                    self._marked.add(student_id)
+
+    def subscribe(self):
+        """Register an event stream; returns the queue its events arrive on"""
+        events = queue.Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self._subscribers_lock:
+            self._subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self._subscribers_lock:
+            if events in self._subscribers:
+                self._subscribers.remove(events)
+
+    def publish(self, event, data):
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            _offer(events, (event, data))
+
+    def stream(self):
+        """Generator of server-sent events for one client, ending when the session closes"""
+        events = self.subscribe()
+        try:
+            # The page was rendered from this state; only changes are sent
+            known = {student_id: record['status'] for student_id, record in self._attendance_rows().items()}
+            yield format_event('stats', self.stats())
+            last_poll = last_sent = time.monotonic()
+            while True:
+                try:
+                    message = events.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    message = ()
+                if message is None:
+                    yield format_event('closed', {'session_id': self.session_id})
+                    return
+                if message:
+                    event, data = message
+                    if event != 'attendance' or known.get(data['student_id']) != data['status']:
+                        if event == 'attendance':
+                            known[data['student_id']] = data['status']
+                        yield format_event(event, data)
+                        last_sent = time.monotonic()
+
+                if time.monotonic() - last_poll >= POLL_INTERVAL:
+                    last_poll = time.monotonic()
+                    if not self._session_open():
+                        # Finalized by another worker
+                        close_live_session(self.session_id)
+                        yield format_event('closed', {'session_id': self.session_id})
+                        return
+                    for student_id, record in self._attendance_rows().items():
+                        if known.get(student_id) != record['status']:
+                            known[student_id] = record['status']
+                            yield format_event('attendance', {
+                                'student_id': student_id,
+                                'status': record['status'],
+                                'recognized': bool(record['recognized'])
+                            })
+                            last_sent = time.monotonic()
+
+                if time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+                    yield ': keep-alive\n\n'
+                    last_sent = time.monotonic()
+        finally:
+            self.unsubscribe(events)
+
+    def close(self):
+        self._closed = True
+        self.pool.cancel(self.pool_key)
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            # None tells stream() to end
+            _offer(events, None)
@@ -0,0 +1,39 @@
+import threading
+import numpy as np
+from deepface import DeepFace
+
+# Cosine distance at which two faces count as the same person (DeepFace defaults).
+# Only vectors from the same pipeline are compared: legacy DeepFace.represent
+# rows are skipped by matching (see FaceEmbedding.PIPELINE).
+COSINE_THRESHOLDS = {'Facenet': 0.40, 'ArcFace': 0.68, 'VGG-Face': 0.68}
+
+_models = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+def get_model(model_name):
+    """Build a DeepFace recognition model once per process and return it.
+
+    DeepFace keeps built models in its own module cache, so later
+    DeepFace.represent calls for the same model reuse this instance. The
+    per-model lock stops concurrent first requests from building it twice.
+    """
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _locks.setdefault(model_name, threading.Lock())
+    with lock:
+        model = _models.get(model_name)
+        if model is None:
+            model = DeepFace.build_model(model_name)
+            _models[model_name] = model
+    return model
+
+def warm_up(model_names=('Facenet',)):
+    """Load models ahead of the first request and run one dummy forward pass"""
+    for model_name in model_names:
+        model = get_model(model_name)
+        height, width = model.input_shape
+        blank = np.zeros((height, width, 3), dtype=np.uint8)
+        DeepFace.represent(img_path=blank, model_name=model_name, enforce_detection=False, detector_backend='skip')
@@ -1,5 +1,25 @@
+import os
+from datetime import datetime, timedelta, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 from .database import Database
+from .embedding_codec import encode_embedding, decode_embedding
+from .dashboard_cache import dashboard_cache
+
+def _invalidate_class_embeddings(class_id=None, user_id=None):
+    # Imported here because embedding_index imports this module
+    from .embedding_index import class_embedding_cache
+    class_embedding_cache.invalidate(class_id=class_id, user_id=user_id)
+
+def _invalidate_dashboards(*tables):
+    dashboard_cache.invalidate(*tables)
+
+def _utc_timestamp(ago=timedelta(0)):
+    # Same format as SQLite's CURRENT_TIMESTAMP, so text comparisons order correctly
+    return (datetime.now(timezone.utc) - ago).strftime('%Y-%m-%d %H:%M:%S')
+
+def _hour_bucket(timestamp):
+    return timestamp[:13] + ':00:00'
+
 class AttendanceSession:
     def __init__(self, db):
         self.db = db
@@ -41,8 +61,10 @@ class TemporaryAttendance:
         conn = self.db.get_db()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT OR REPLACE INTO temporary_attendance (session_id, student_id, status, recognized, face_image_path)
+            INSERT INTO temporary_attendance (session_id, student_id, status, recognized, face_image_path)
             VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(session_id, student_id) DO UPDATE SET
+                status=excluded.status, recognized=excluded.recognized, face_image_path=excluded.face_image_path
         ''', (session_id, student_id, status, int(recognized), face_image_path))
         conn.commit()
         conn.close()
@@ -122,8 +144,10 @@ class User:
             conn.commit()
             user_id = cursor.lastrowid
             conn.close()
+            _invalidate_dashboards('users')
             return user_id
         except:
+            conn.rollback()
             conn.close()
             return None
     
@@ -139,24 +163,41 @@ class User:
         return users
 
 class UserActivity:
-    def __init__(self, db):
+    def __init__(self, db, archive_path=None):
         self.db = db
+        # Raw rows past retention move into monthly tables in this database file
+        self.archive_path = archive_path or os.path.splitext(db.db_path)[0] + '_archive.db'
     
     def log_activity(self, user_id, activity_type, page_url=None, action_description=None, ip_address=None, user_agent=None):
-        conn = self.db.get_db()
-        cursor = conn.cursor()
         try:
-            cursor.execute('''
-                INSERT INTO user_activity (user_id, activity_type, page_url, action_description, ip_address, user_agent) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, activity_type, page_url, action_description, ip_address, user_agent))
-            conn.commit()
-            conn.close()
+            self.log_activity_batch([(user_id, activity_type, page_url, action_description, ip_address, user_agent, _utc_timestamp())])
             return True
         except:
-            conn.close()
             return False
     
+    def log_activity_batch(self, rows):
+        """Insert many (user_id, activity_type, page_url, action_description, ip_address, user_agent, created_at) rows in one transaction"""
+        # Fold the batch into per-user hourly counts before touching the rollup table
+        hourly = {}
+        for row in rows:
+            key = (row[0], _hour_bucket(row[6]))
+            count, last_activity = hourly.get(key, (0, row[6]))
+            hourly[key] = (count + 1, max(last_activity, row[6]))
+        def write(conn):
+            conn.executemany('''
+                INSERT INTO user_activity (user_id, activity_type, page_url, action_description, ip_address, user_agent, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.executemany('''
+                INSERT INTO user_activity_hourly (user_id, hour, activity_count, last_activity)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, hour) DO UPDATE SET
+                    activity_count = activity_count + excluded.activity_count,
+                    last_activity = MAX(last_activity, excluded.last_activity)
+            ''', [(user_id, hour, count, last_activity) for (user_id, hour), (count, last_activity) in hourly.items()])
+        self.db.run_write(write)
+        return len(rows)
+    
     def get_user_activity(self, user_id, limit=50):
         conn = self.db.get_db()
         cursor = conn.cursor()
@@ -173,61 +214,176 @@ class UserActivity:
     def get_recent_activity(self, hours=24, role=None):
         conn = self.db.get_db()
         cursor = conn.cursor()
+        since = _utc_timestamp(timedelta(hours=hours))
         
         if role:
             cursor.execute('''
                 SELECT ua.*, u.name as user_name, u.role 
                 FROM user_activity ua 
                 JOIN users u ON ua.user_id = u.id 
-                WHERE ua.created_at >= datetime('now', '-' || ? || ' hours') AND u.role = ?
+                WHERE ua.created_at >= ? AND u.role = ?
                 ORDER BY ua.created_at DESC
-            ''', (hours, role))
+            ''', (since, role))
         else:
             cursor.execute('''
                 SELECT ua.*, u.name as user_name, u.role 
                 FROM user_activity ua 
                 JOIN users u ON ua.user_id = u.id 
-                WHERE ua.created_at >= datetime('now', '-' || ? || ' hours')
+                WHERE ua.created_at >= ?
                 ORDER BY ua.created_at DESC
-            ''', (hours,))
+            ''', (since,))
         
         activities = cursor.fetchall()
         conn.close()
         return activities
     
     def get_active_users(self, hours=24):
+        """Users active in the last N hours, read from the hourly rollups (to the hour)"""
         conn = self.db.get_db()
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT DISTINCT u.id, u.name, u.role, u.username,
-                   MAX(ua.created_at) as last_activity,
-                   COUNT(ua.id) as activity_count
-            FROM users u 
-            JOIN user_activity ua ON u.id = ua.user_id 
-            WHERE ua.created_at >= datetime('now', '-' || ? || ' hours')
-            GROUP BY u.id 
+            SELECT u.id, u.name, u.role, u.username,
+                   MAX(h.last_activity) as last_activity,
+                   SUM(h.activity_count) as activity_count
+            FROM user_activity_hourly h 
+            JOIN users u ON u.id = h.user_id 
+            WHERE h.hour >= ?
+            GROUP BY h.user_id 
             ORDER BY last_activity DESC
-        ''', (hours,))
+        ''', (_hour_bucket(_utc_timestamp(timedelta(hours=hours))),))
         active_users = cursor.fetchall()
         conn.close()
         return active_users
 
+    def apply_retention(self, retention_days=30, rollup_days=400, archive_months=12):
+        """Move raw rows older than retention_days into the archive and prune old rollups.
+
+        Archived rows go to one user_activity_YYYY_MM table per month in the
+        archive database; month tables older than archive_months are dropped
+        (0 keeps them forever). Returns how many raw rows were archived.
+
+        In WAL mode a commit spanning two database files is not atomic, so
+        the archive copy is committed first and the raw rows are deleted in a
+        second transaction. If that one fails the rows stay in both places,
+        and the next run's INSERT OR IGNORE skips them.
+        """
+        cutoff = _utc_timestamp(timedelta(days=retention_days))
+        conn = self.db.get_db()
+        cursor = conn.cursor()
+        attached = False
+        try:
+            cursor.execute('ATTACH DATABASE ? AS archive', (self.archive_path,))
+            attached = True
+            cursor.execute('''
+                SELECT DISTINCT substr(created_at, 1, 7) AS month FROM user_activity
+                WHERE created_at < ?
+            ''', (cutoff,))
+            months = [row['month'] for row in cursor.fetchall()]
+            archived = 0
+            for month in months:
+                table = 'user_activity_' + month.replace('-', '_')
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS archive.{table} (
+                        id INTEGER PRIMARY KEY,
+                        user_id INTEGER NOT NULL,
+                        activity_type TEXT NOT NULL,
+                        page_url TEXT,
+                        action_description TEXT,
+                        ip_address TEXT,
+                        user_agent TEXT,
+                        created_at TIMESTAMP
+                    )
+                ''')
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO archive.{table}
+                    SELECT id, user_id, activity_type, page_url, action_description, ip_address, user_agent, created_at
+                    FROM main.user_activity
+                    WHERE created_at < ? AND substr(created_at, 1, 7) = ?
+                ''', (cutoff, month))
+                archived += cursor.rowcount
+            conn.commit()
+
+            cursor.execute('DELETE FROM main.user_activity WHERE created_at < ?', (cutoff,))
+            cursor.execute('DELETE FROM main.user_activity_hourly WHERE hour < ?',
+                           (_hour_bucket(_utc_timestamp(timedelta(days=rollup_days))),))
+            if archive_months:
+                oldest = _utc_timestamp(timedelta(days=31 * archive_months))[:7].replace('-', '_')
+                cursor.execute("SELECT name FROM archive.sqlite_master WHERE type='table' AND name LIKE 'user_activity_%'")
+                for row in cursor.fetchall():
+                    if row['name'][len('user_activity_'):] < oldest:
+                        cursor.execute(f"DROP TABLE archive.{row['name']}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if attached:
+                try:
+                    cursor.execute('DETACH DATABASE archive')
+                except Exception as e:
+                    print(f"Could not detach activity archive: {e}")
+            conn.close()
+        return archived
+
+class CacheGeneration:
+    """Write counters in the database, shared by every process that opens it.
+
+    Writers bump a name in the same transaction as their change; in-memory
+    caches remember the value they loaded at and reload once it has moved.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def bump(cursor, name):
+        """Increment a counter inside the caller's transaction; returns the new value"""
+        cursor.execute('''
+            INSERT INTO cache_generations (name, generation) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET generation = generation + 1
+        ''', (name,))
+        cursor.execute('SELECT generation FROM cache_generations WHERE name = ?', (name,))
+        return cursor.fetchone()[0]
+
+    def get(self, name):
+        return self.get_all((name,))[0]
+
+    def get_all(self, names):
+        """Current values for several counters, in the order given (0 if never bumped)"""
+        conn = self.db.get_db()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(names))
+        cursor.execute(f'SELECT name, generation FROM cache_generations WHERE name IN ({placeholders})', tuple(names))
+        found = {row['name']: row['generation'] for row in cursor.fetchall()}
+        conn.close()
+        return tuple(found.get(name, 0) for name in names)
+
 class FaceEmbedding:
+    # Pipeline that computes new vectors (detect, crop, batched forward pass).
+    # Rows with any other pipeline (NULL: legacy DeepFace.represent) are not
+    # comparable and are left out of matching until re-enrolled.
+    PIPELINE = 'detector-crop'
+
     def __init__(self, db):
         self.db = db
 
-    def upsert_embedding(self, user_id, pose, model_name, embedding_text):
+    def upsert_embedding(self, user_id, pose, model_name, vector):
+        """Store a vector; returns the new face_embeddings generation"""
         conn = self.db.get_db()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO face_embeddings (user_id, pose, model_name, embedding)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(user_id, pose, model_name) DO UPDATE SET embedding=excluded.embedding, created_at=CURRENT_TIMESTAMP
-        ''', (user_id, pose, model_name, embedding_text))
+            INSERT INTO face_embeddings (user_id, pose, model_name, embedding, pipeline)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, pose, model_name) DO UPDATE SET embedding=excluded.embedding, pipeline=excluded.pipeline, created_at=CURRENT_TIMESTAMP
+        ''', (user_id, pose, model_name, encode_embedding(vector), self.PIPELINE))
+        generation = CacheGeneration.bump(cursor, 'face_embeddings')
         conn.commit()
         conn.close()
+        _invalidate_class_embeddings(user_id=user_id)
+        return generation
 
     def get_user_embeddings(self, user_id, model_name=None):
+        """Get a user's embeddings as dicts with the vector decoded into 'embedding'"""
         conn = self.db.get_db()
         cursor = conn.cursor()
         if model_name:
@@ -236,12 +392,45 @@ class FaceEmbedding:
             cursor.execute('SELECT * FROM face_embeddings WHERE user_id = ? ORDER BY model_name, pose', (user_id,))
         rows = cursor.fetchall()
         conn.close()
+        embeddings = []
+        for row in rows:
+            row_dict = dict(row)
+            row_dict['embedding'] = decode_embedding(row['embedding'])
+            embeddings.append(row_dict)
+        return embeddings
+
+    def get_all_embeddings(self, model_name):
+        """Get every current-pipeline embedding for a model"""
+        conn = self.db.get_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, pose, embedding FROM face_embeddings
+            WHERE model_name = ? AND pipeline = ?
+            ORDER BY user_id, pose
+        ''', (model_name, self.PIPELINE))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    def get_class_embeddings(self, class_id, model_name):
+        """Get embeddings of a class's students; students without any get one row with NULL pose/embedding"""
+        conn = self.db.get_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT ca.user_id, fe.pose, fe.embedding FROM class_assignments ca
+            LEFT JOIN face_embeddings fe ON fe.user_id = ca.user_id AND fe.model_name = ? AND fe.pipeline = ?
+            WHERE ca.class_id = ? AND ca.role = 'student'
+            ORDER BY ca.user_id, fe.pose
+        ''', (model_name, self.PIPELINE, class_id))
+        rows = cursor.fetchall()
+        conn.close()
         return rows
 
     def has_any_embeddings(self, user_id):
+        """Check if a user has embeddings that matching can use"""
         conn = self.db.get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(1) FROM face_embeddings WHERE user_id = ?', (user_id,))
+        cursor.execute('SELECT COUNT(1) FROM face_embeddings WHERE user_id = ? AND pipeline = ?', (user_id, self.PIPELINE))
         count = cursor.fetchone()[0]
         conn.close()
         return count > 0
@@ -257,6 +446,7 @@ class Class:
         conn.commit()
         class_id = cursor.lastrowid
         conn.close()
+        _invalidate_dashboards('classes')
         return class_id
         
     def delete(self, class_id):
@@ -267,8 +457,11 @@ class Class:
             cursor.execute('DELETE FROM class_assignments WHERE class_id = ?', (class_id,))
             # Then delete the class
             cursor.execute('DELETE FROM classes WHERE id = ?', (class_id,))
+            CacheGeneration.bump(cursor, 'class_roster')
             conn.commit()
             conn.close()
+            _invalidate_class_embeddings(class_id=class_id)
+            _invalidate_dashboards('classes', 'class_assignments')
             return True
         except Exception as e:
             conn.rollback()
@@ -282,6 +475,27 @@ class Class:
         classes = cursor.fetchall()
         conn.close()
         return classes
+
+    def get_all_with_stats(self):
+        """Get all classes with teacher names (joined by the unit separator, char 31) and student counts in one query"""
+        conn = self.db.get_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT c.*,
+                   (SELECT GROUP_CONCAT(t.name, char(31)) FROM (
+                        SELECT u.name FROM class_assignments ca
+                        JOIN users u ON u.id = ca.user_id
+                        WHERE ca.class_id = c.id AND ca.role = 'teacher'
+                        ORDER BY ca.id
+                    ) t) as teacher_names,
+                   (SELECT COUNT(*) FROM class_assignments ca
+                    WHERE ca.class_id = c.id AND ca.role = 'student') as student_count
+            FROM classes c
+            ORDER BY c.name
+        ''')
+        classes = cursor.fetchall()
+        conn.close()
+        return classes
     
     def get_by_id(self, class_id):
         conn = self.db.get_db()
@@ -303,6 +517,7 @@ class Class:
                               (name, class_id))
             conn.commit()
             conn.close()
+            _invalidate_dashboards('classes')
             return True
         except Exception as e:
             conn.rollback()
@@ -348,8 +563,10 @@ class ClassAssignment:
             ''', (user_id, class_id))
             conn.commit()
             conn.close()
+            _invalidate_dashboards('class_assignments')
             return True
         except:
+            conn.rollback()
             conn.close()
             return False
     
@@ -363,6 +580,7 @@ class ClassAssignment:
             ''', (user_id, class_id))
             conn.commit()
             conn.close()
+            _invalidate_dashboards('class_assignments')
             return True
         except:
             conn.rollback()
@@ -377,10 +595,14 @@ class ClassAssignment:
                 INSERT INTO class_assignments (user_id, class_id, role, roll_number) 
                 VALUES (?, ?, 'student', ?)
             ''', (user_id, class_id, roll_number))
+            CacheGeneration.bump(cursor, 'class_roster')
             conn.commit()
             conn.close()
+            _invalidate_class_embeddings(class_id=class_id)
+            _invalidate_dashboards('class_assignments')
             return True
         except:
+            conn.rollback()
             conn.close()
             return False
     
@@ -406,25 +628,69 @@ class ClassAssignment:
         return classes
 
 class Attendance:
+    # Recount one class/date from attendance into attendance_daily_summary
+    DAILY_SUMMARY_REFRESH = '''
+        INSERT OR REPLACE INTO attendance_daily_summary (class_id, date, present, absent, late, total)
+        SELECT class_id, date,
+               SUM(status = 'present'), SUM(status = 'absent'), SUM(status = 'late'), COUNT(*)
+        FROM attendance
+        WHERE class_id = ? AND date = ?
+        GROUP BY class_id, date
+    '''
+
     def __init__(self, db):
         self.db = db
     
     def mark_attendance(self, user_id, class_id, date, status, marked_by, remarks=None, attendance_type="regular"):
-        conn = self.db.get_db()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
+        # The row and its summary recount commit together
+        def write(conn):
+            conn.execute('''
                 INSERT OR REPLACE INTO attendance (user_id, class_id, date, status, marked_by, remarks, attendance_type) 
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, class_id, date, status, marked_by, remarks, attendance_type))
-            conn.commit()
-            conn.close()
+            conn.execute(self.DAILY_SUMMARY_REFRESH, (class_id, date))
+        try:
+            self.db.run_write(write)
+            _invalidate_dashboards('attendance')
             return True
         except Exception as e:
             print(f"Error marking attendance: {e}")
-            conn.close()
             return False
     
+    def mark_attendance_batch(self, rows):
+        """Upsert many (user_id, class_id, date, status, marked_by, remarks, attendance_type) rows atomically"""
+        def write(conn):
+            conn.executemany('''
+                INSERT OR REPLACE INTO attendance (user_id, class_id, date, status, marked_by, remarks, attendance_type) 
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.executemany(self.DAILY_SUMMARY_REFRESH, {(row[1], row[2]) for row in rows})
+        self.db.run_write(write)
+        _invalidate_dashboards('attendance')
+        return len(rows)
+
+    def refresh_daily_summary(self, class_id, date):
+        """Recount a class's attendance_daily_summary row for one date"""
+        self.db.execute_write(self.DAILY_SUMMARY_REFRESH, (class_id, date))
+        _invalidate_dashboards('attendance')
+
+    def get_daily_summary(self, date, class_ids=None):
+        """Get attendance_daily_summary rows for a date, optionally limited to some classes"""
+        conn = self.db.get_db()
+        cursor = conn.cursor()
+        if class_ids is None:
+            cursor.execute('SELECT * FROM attendance_daily_summary WHERE date = ?', (date,))
+        else:
+            class_ids = list(class_ids)
+            placeholders = ','.join('?' * len(class_ids))
+            cursor.execute(f'''
+                SELECT * FROM attendance_daily_summary
+                WHERE date = ? AND class_id IN ({placeholders})
+            ''', [date] + class_ids)
+        summary = cursor.fetchall()
+        conn.close()
+        return summary
+    
     def get_class_attendance(self, class_id, date):
         conn = self.db.get_db()
         cursor = conn.cursor()
@@ -489,6 +755,57 @@ class Attendance:
         conn.close()
         return attendance
 
+    def get_class_attendance_stats(self, class_id, start_date=None, end_date=None):
+        """Get per-student attendance totals for a class in one grouped query"""
+        conn = self.db.get_db()
+        cursor = conn.cursor()
+        
+        query_params = [class_id]
+        date_filter = ''
+        if start_date:
+            date_filter += ' AND a.date >= ?'
+            query_params.append(start_date)
+        if end_date:
+            date_filter += ' AND a.date <= ?'
+            query_params.append(end_date)
+        query_params.append(class_id)
+        
+        cursor.execute(f'''
+            SELECT ca.user_id,
+                   COUNT(a.id) as total_days,
+                   COALESCE(SUM(a.status = 'present'), 0) as present_days
+            FROM class_assignments ca
+            LEFT JOIN attendance a ON a.user_id = ca.user_id AND a.class_id = ?{date_filter}
+            WHERE ca.class_id = ? AND ca.role = 'student'
+            GROUP BY ca.user_id
+        ''', query_params)
+        
+        stats = cursor.fetchall()
+        conn.close()
+        return stats
+
+class DashboardStats:
+    def __init__(self, db):
+        self.db = db
+
+    def get_counts(self):
+        """User counts per role and the class count, in one query"""
+        conn = self.db.get_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT 'role' AS kind, role AS name, COUNT(*) AS count FROM users GROUP BY role
+            UNION ALL
+            SELECT 'classes', NULL, COUNT(*) FROM classes
+        ''')
+        rows = cursor.fetchall()
+        conn.close()
+        users_by_role = {row['name']: row['count'] for row in rows if row['kind'] == 'role'}
+        return {
+            'users_by_role': users_by_role,
+            'total_users': sum(users_by_role.values()),
+            'total_classes': next(row['count'] for row in rows if row['kind'] == 'classes')
+        }
+
 class ClassRequest:
     def __init__(self, db):
         self.db = db
@@ -547,6 +864,7 @@ class ClassRequest:
             
             conn.commit()
             conn.close()
+            _invalidate_dashboards('classes', 'class_assignments')
             return True
         
         conn.close()
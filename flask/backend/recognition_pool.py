@@ -0,0 +1,105 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from .background import BackgroundThreads
+
+# Seconds a request waits for its recognition result before answering "busy"
+RESULT_TIMEOUT = float(os.environ.get('RECOGNITION_TIMEOUT', 2.0))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class RecognitionBusy(Exception):
+    """Raised when every pending slot is taken; the client should retry shortly"""
+
+class StaleFrame(Exception):
+    """Set on a frame's Future when a newer frame from the same source replaced it"""
+
+def get_recognition_pool():
+    """Process-wide pool; sized by RECOGNITION_WORKERS and RECOGNITION_MAX_PENDING"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RecognitionPool(
+                workers=int(os.environ.get('RECOGNITION_WORKERS', 2)),
+                max_pending=int(os.environ.get('RECOGNITION_MAX_PENDING', 16))
+            )
+        return _pool
+
+class RecognitionPool:
+    """Fixed set of recognition workers fed by one newest-frame slot per source (session or class page)"""
+
+    def __init__(self, workers=2, max_pending=16):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._workers = BackgroundThreads('recognition-worker', self._run, count=workers)
+        self.submitted = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.processed = 0
+        self.in_flight = 0
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) as the newest work for key; returns a Future of its result"""
+        future = Future()
+        with self._cond:
+            if not self._workers.started():
+                self._workers.start()
+            previous = self._pending.get(key)
+            if previous is not None:
+                self.dropped += 1
+                previous[2].set_exception(StaleFrame())
+            elif len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                raise RecognitionBusy()
+            # Assigning to an existing key keeps the source's place in line
+            self._pending[key] = (fn, args, future)
+            self.submitted += 1
+            self._cond.notify()
+        return future
+
+    def cancel(self, key, future=None):
+        """Drop the pending frame for key, if any; with future, only if it is still that frame"""
+        with self._cond:
+            previous = self._pending.get(key)
+            if previous is not None and (future is None or previous[2] is future):
+                del self._pending[key]
+            else:
+                previous = None
+        if previous is not None:
+            previous[2].cancel()
+        elif future is not None:
+            # Already running or replaced; cancel() is then a no-op
+            future.cancel()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'depth': len(self._pending),
+                'max_pending': self.max_pending,
+                'in_flight': self.in_flight,
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'rejected': self.rejected
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                _, (fn, args, future) = self._pending.popitem(last=False)
+                self.in_flight += 1
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            with self._cond:
+                self.in_flight -= 1
+                self.processed += 1
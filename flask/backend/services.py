@@ -1,12 +1,11 @@
+from collections import defaultdict
 from datetime import datetime, date
 from .database import Database
-from .models import User, Class, ClassAssignment, Attendance, ClassRequest, UserActivity, AttendanceSession, TemporaryAttendance, UnrecognizedFace
+from .models import User, Class, ClassAssignment, Attendance, ClassRequest, UserActivity, AttendanceSession, TemporaryAttendance, UnrecognizedFace, DashboardStats
 from .face_recognition import FaceRecognition
-import cv2
-import numpy as np
-from PIL import Image
-import io
-import base64
+from .frames import DecodedFrame
+from .dashboard_cache import dashboard_cache
+from . import live_sessions
 
 class AttendanceSessionService:
     def __init__(self):
@@ -14,17 +13,39 @@ class AttendanceSessionService:
         self.session_model = AttendanceSession(self.db)
         self.temp_attendance_model = TemporaryAttendance(self.db)
         self.unrec_face_model = UnrecognizedFace(self.db)
+        self.attendance_model = Attendance(self.db)
 
     def start_session(self, class_id, teacher_id):
         return self.session_model.create(class_id, teacher_id)
 
+    def get_session(self, session_id):
+        return self.session_model.get_by_id(session_id)
+
     def finalize_session(self, session_id):
+        session_row = self.session_model.get_by_id(session_id)
         self.session_model.finalize(session_id)
+        if session_row is not None:
+            self.attendance_model.refresh_daily_summary(session_row['class_id'], session_row['date'])
         self.temp_attendance_model.delete_by_session(session_id)
         self.unrec_face_model.delete_by_session(session_id)
+        live_sessions.close_live_session(session_id)
 
     def mark_temporary_attendance(self, session_id, student_id, status, recognized=True, face_image_path=None):
         self.temp_attendance_model.mark(session_id, student_id, status, recognized, face_image_path)
+        live_sessions.notify(session_id, 'attendance', {
+            'student_id': int(student_id),
+            'status': status,
+            'recognized': bool(recognized)
+        })
+
+    def get_live_session(self, session_id, recognizer):
+        """Streaming recognition state for an in-progress session, or None"""
+        session_row = self.session_model.get_by_id(session_id)
+        if session_row is None or session_row['status'] != 'In Progress':
+            # Finalized, possibly by another worker; drop this process's state
+            live_sessions.close_live_session(session_id)
+            return None
+        return live_sessions.get_live_session(session_id, session_row['class_id'], recognizer, self)
 
     def get_temporary_attendance(self, session_id):
         return self.temp_attendance_model.get_by_session(session_id)
@@ -36,7 +57,7 @@ class AttendanceSessionService:
         return self.unrec_face_model.get_by_session(session_id)
 
     def assign_unrecognized_face(self, session_id, student_id, face_image_path):
-        self.temp_attendance_model.mark(session_id, student_id, 'Present (Temporary)', True, face_image_path)
+        self.mark_temporary_attendance(session_id, student_id, 'Present (Temporary)', True, face_image_path)
 
 class UserService:
     def __init__(self):
@@ -44,6 +65,7 @@ class UserService:
         self.user_model = User(self.db)
         self.face_recognition = FaceRecognition()
         self.activity_model = UserActivity(self.db)
+        self.class_model = Class(self.db)
     
     def create_user(self, username, password, email, name, role):
         """Create a new user"""
@@ -61,6 +83,10 @@ class UserService:
         """Get all users, optionally filtered by role"""
         return self.user_model.get_all(role)
     
+    def get_students_by_class(self, class_id):
+        """Get the students enrolled in a class as dictionaries"""
+        return [dict(student) for student in self.class_model.get_students(class_id)]
+    
     def capture_user_face(self, user_id, method='camera', image_data=None, pose='front'):
         """Capture face data/embedding for a user with quality validation"""
         return self.face_recognition.capture_face(user_id, method, image_data, pose)
@@ -68,15 +94,8 @@ class UserService:
     def validate_face_quality(self, image_data, pose=None):
         """Validate face quality from image data, with optional pose guidance"""
         try:
-            # Decode base64 image data
-            if image_data.startswith('data:image'):
-                image_data = image_data.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
-            return self.face_recognition.validate_face_quality(opencv_image, pose)
+            frame = image_data if isinstance(image_data, DecodedFrame) else DecodedFrame.from_base64(image_data)
+            return self.face_recognition.validate_face_quality(frame, pose)
         except Exception as e:
             return False, f"Error validating image: {str(e)}"
     
@@ -90,16 +109,12 @@ class UserService:
 
     def backfill_embeddings_from_image(self, user_id, poses=("front",)):
         """If a legacy face image exists, compute embeddings for given poses using same image."""
-        from PIL import Image
         import os
-        import numpy as np
-        import cv2
         face_path = os.path.join(self.face_recognition.faces_dir, f'user_{user_id}.jpg')
         if not os.path.exists(face_path):
             return False, "No legacy face image found"
-        image = Image.open(face_path)
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        vector = self.face_recognition.compute_embedding_from_image(opencv_image)
+        frame = DecodedFrame.from_file(face_path)
+        vector = self.face_recognition.compute_embedding_from_image(frame)
         if vector is None:
             return False, "Failed to compute embedding from image"
         for p in poses:
@@ -126,29 +141,13 @@ class ClassService:
     
     def get_all_classes(self):
         """Get all classes with teacher names and student counts"""
-        classes = self.class_model.get_all()
-        
-        # Convert sqlite3.Row objects to dictionaries and enhance with additional data
         enhanced_classes = []
-        for class_data in classes:
-            # Convert to dict
+        for class_data in self.class_model.get_all_with_stats():
             class_dict = dict(class_data)
-            
-            # Get all teachers for this class
-            teachers = self.get_class_teachers(class_dict['id'])
-            if teachers:
-                # Store all teacher names in a list
-                class_dict['teachers'] = [teacher['name'] for teacher in teachers]
-                # Keep teacher_name for backward compatibility
-                class_dict['teacher_name'] = teachers[0]['name'] if teachers else None
-            else:
-                class_dict['teachers'] = []
-                class_dict['teacher_name'] = None
-            
-            # Get student count
-            students = self.get_class_students(class_dict['id'])
-            class_dict['student_count'] = len(students)
-            
+            teacher_names = class_dict.pop('teacher_names')
+            class_dict['teachers'] = teacher_names.split(chr(31)) if teacher_names else []
+            # Keep teacher_name for backward compatibility
+            class_dict['teacher_name'] = class_dict['teachers'][0] if class_dict['teachers'] else None
             enhanced_classes.append(class_dict)
         
         return enhanced_classes
@@ -205,6 +204,7 @@ class AttendanceService:
     def __init__(self):
         self.db = Database()
         self.attendance_model = Attendance(self.db)
+        self.class_model = Class(self.db)
         self.face_recognition = FaceRecognition()
     
     def mark_attendance(self, user_id, class_id, date, status, marked_by, remarks=None, attendance_type="regular"):
@@ -299,42 +299,54 @@ class AttendanceService:
             return False, "No face data found for this user. Please capture face data first."
             
     def save_attendance_batch(self, class_id, attendance_date, records, marked_by):
-        """Save batch attendance records for a class"""
+        """Validate and save batch attendance records for a class in one transaction.
+        
+        Returns (success, message, errors) where errors lists the rejected rows
+        as {'index', 'student_id', 'message'}. Nothing is written unless every
+        row is valid and the whole batch commits.
+        """
         try:
             # Validate inputs
             if not class_id or not records:
-                return False, "Missing required parameters"
+                return False, "Missing required parameters", []
                 
             # Format date if needed
             if isinstance(attendance_date, str):
                 attendance_date = attendance_date.split('T')[0]  # Handle ISO format
-                
-            # Process each record
-            success_count = 0
-            for record in records:
+            
+            enrolled = {student['id'] for student in self.class_model.get_students(class_id)}
+            
+            # Validate every record before writing anything
+            rows = []
+            errors = []
+            for index, record in enumerate(records):
                 student_id = record.get('student_id')
                 status = record.get('status')
-                timestamp = record.get('timestamp')
                 attendance_type = record.get('type', 'Regular')
                 remarks = record.get('remarks', '')
                 
-                if student_id and status:
-                    # Mark attendance for this student
-                    self.attendance_model.mark_attendance(
-                        student_id, 
-                        class_id, 
-                        attendance_date, 
-                        status, 
-                        marked_by, 
-                        remarks, 
-                        attendance_type
-                    )
-                    success_count += 1
+                try:
+                    student_id = int(student_id)
+                except (TypeError, ValueError):
+                    errors.append({'index': index, 'student_id': student_id, 'message': 'Invalid student ID'})
+                    continue
+                if not status:
+                    errors.append({'index': index, 'student_id': student_id, 'message': 'Missing status'})
+                    continue
+                if student_id not in enrolled:
+                    errors.append({'index': index, 'student_id': student_id, 'message': 'Student not in this class'})
+                    continue
+                
+                rows.append((student_id, class_id, attendance_date, status, marked_by, remarks, attendance_type))
+            
+            if errors:
+                return False, f"{len(errors)} of {len(records)} attendance records are invalid; nothing was saved", errors
             
-            return True, f"Successfully saved {success_count} attendance records"
+            self.attendance_model.mark_attendance_batch(rows)
+            return True, f"Successfully saved {len(rows)} attendance records", []
             
         except Exception as e:
-            return False, f"Error saving attendance: {str(e)}"
+            return False, f"Error saving attendance: {str(e)}", []
         
         # Check if attendance already marked for today
         today = date.today()
@@ -372,13 +384,8 @@ class AttendanceService:
         else:
             return False, "Failed to mark attendance"
     
-    def get_attendance_stats(self, user_id, class_id=None):
-        """Get attendance statistics for a student"""
-        attendance_records = self.get_student_attendance(user_id, class_id)
-        
-        total_days = len(attendance_records)
-        present_days = len([r for r in attendance_records if r['status'] == 'present'])
-        
+    @staticmethod
+    def _format_stats(total_days, present_days):
         if total_days > 0:
             attendance_rate = (present_days / total_days) * 100
         else:
@@ -390,6 +397,17 @@ class AttendanceService:
             'absent_days': total_days - present_days,
             'attendance_rate': round(attendance_rate, 2)
         }
+    
+    def get_class_attendance_stats(self, class_id, start_date=None, end_date=None):
+        """Get attendance statistics for every student in a class, keyed by student id.
+        
+        Students without any records (e.g. enrolled after the query) get zeroed stats.
+        """
+        rows = self.attendance_model.get_class_attendance_stats(class_id, start_date, end_date)
+        stats = defaultdict(lambda: self._format_stats(0, 0))
+        for row in rows:
+            stats[row['user_id']] = self._format_stats(row['total_days'], row['present_days'])
+        return stats
 
 class ClassRequestService:
     def __init__(self):
@@ -451,43 +469,47 @@ class DashboardService:
         self.class_model = Class(self.db)
         self.attendance_model = Attendance(self.db)
         self.activity_model = UserActivity(self.db)
+        self.stats_model = DashboardStats(self.db)
     
     def get_admin_dashboard_data(self):
         """Get data for admin dashboard"""
-        users = self.user_model.get_all()
-        classes = self.class_model.get_all()
-        
-        # Count by role
-        students = [u for u in users if u['role'] == 'student']
-        teachers = [u for u in users if u['role'] == 'teacher']
+        # Recent activity is not an invalidating table; it refreshes with the TTL
+        return dashboard_cache.get_or_compute(
+            (self.db.db_path, 'admin'), ('users', 'classes', 'attendance'),
+            self._admin_dashboard_data)
+
+    def get_teacher_dashboard_data(self, teacher_id):
+        """Get data for teacher dashboard"""
+        return dashboard_cache.get_or_compute(
+            (self.db.db_path, 'teacher', int(teacher_id)), ('classes', 'class_assignments', 'attendance'),
+            lambda: self._teacher_dashboard_data(teacher_id))
+
+    def get_student_dashboard_data(self, student_id):
+        """Get data for student dashboard"""
+        return dashboard_cache.get_or_compute(
+            (self.db.db_path, 'student', int(student_id)), ('classes', 'class_assignments', 'attendance'),
+            lambda: self._student_dashboard_data(student_id))
+
+    def _admin_dashboard_data(self):
+        counts = self.stats_model.get_counts()
         
         # Get today's attendance
-        today = date.today()
-        conn = self.db.get_db()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) as today_attendance 
-            FROM attendance 
-            WHERE date = ? AND status = 'present'
-        ''', (today,))
-        today_attendance = cursor.fetchone()['today_attendance']
-        conn.close()
+        today_attendance = sum(row['present'] for row in self.attendance_model.get_daily_summary(date.today()))
         
         # Get recent activity
         recent_activity = self.activity_model.get_recent_activity(hours=24, role='teacher')
         active_teachers = self.activity_model.get_active_users(hours=24)
         
         return {
-            'total_students': len(students),
-            'total_teachers': len(teachers),
-            'total_classes': len(classes),
+            'total_students': counts['users_by_role'].get('student', 0),
+            'total_teachers': counts['users_by_role'].get('teacher', 0),
+            'total_classes': counts['total_classes'],
             'today_attendance': today_attendance,
             'recent_activity': recent_activity[:10],  # Last 10 activities
             'active_teachers': [u for u in active_teachers if u['role'] == 'teacher']
         }
     
-    def get_teacher_dashboard_data(self, teacher_id):
-        """Get data for teacher dashboard"""
+    def _teacher_dashboard_data(self, teacher_id):
         # Get teacher's classes
         conn = self.db.get_db()
         cursor = conn.cursor()
@@ -500,31 +522,18 @@ class DashboardService:
             GROUP BY c.id
         ''', (teacher_id,))
         classes = cursor.fetchall()
+        conn.close()
         
         # Get today's attendance for teacher's classes
-        today = date.today()
-        cursor.execute('''
-            SELECT COUNT(*) as today_attendance
-            FROM attendance a
-            JOIN class_assignments ca ON a.user_id = ca.user_id AND a.class_id = ca.class_id
-            WHERE ca.user_id IN (
-                SELECT ca2.user_id FROM class_assignments ca2 
-                WHERE ca2.class_id IN (
-                    SELECT ca3.class_id FROM class_assignments ca3 
-                    WHERE ca3.user_id = ? AND ca3.role = 'teacher'
-                ) AND ca2.role = 'student'
-            ) AND a.date = ? AND a.status = 'present'
-        ''', (teacher_id, today))
-        today_attendance = cursor.fetchone()['today_attendance']
-        conn.close()
+        summary = self.attendance_model.get_daily_summary(date.today(), [c['id'] for c in classes]) if classes else []
+        today_attendance = sum(row['present'] for row in summary)
         
         return {
             'classes': classes,
             'today_attendance': today_attendance
         }
     
-    def get_student_dashboard_data(self, student_id):
-        """Get data for student dashboard"""
+    def _student_dashboard_data(self, student_id):
         # Get student's classes
         conn = self.db.get_db()
         cursor = conn.cursor()
@@ -536,12 +545,12 @@ class DashboardService:
         classes = cursor.fetchall()
         conn.close()
         
-        # Get attendance statistics
-        attendance_service = AttendanceService()
-        stats = attendance_service.get_attendance_stats(student_id)
-        
-        # Get recent attendance
-        recent_attendance = self.attendance_model.get_student_attendance(student_id)[:5]
+        # Get attendance statistics and recent attendance from one query
+        # (building an AttendanceService here would construct a FaceRecognition per hit)
+        attendance_records = self.attendance_model.get_student_attendance(student_id)
+        present_days = len([r for r in attendance_records if r['status'] == 'present'])
+        stats = AttendanceService._format_stats(len(attendance_records), present_days)
+        recent_attendance = attendance_records[:5]
         
         return {
             'classes': classes,
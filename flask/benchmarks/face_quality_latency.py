@@ -0,0 +1,78 @@
+"""Per-call latency of FaceRecognition.validate_face_quality.
+
+Times the same images with cascades reused from the detector registry and
+with cascades rebuilt before every call (what validation did before the
+registry), and prints median / p95 milliseconds for both. Each call runs on
+a new thread, --threads at a time, the way the threaded server handles
+requests.
+
+Usage (from the flask directory):
+    python benchmarks/face_quality_latency.py [--repeat N] [--threads N] [image ...]
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+from backend import detector_registry
+from backend.face_recognition import FaceRecognition
+
+def time_calls(recognizer, images, repeat, threads, reload_cascades):
+    timings = []
+    lock = threading.Lock()
+
+    def call(image):
+        if reload_cascades:
+            # Forget the built cascades so the call parses the XML again
+            detector_registry.clear_detectors()
+        start = time.perf_counter()
+        recognizer.validate_face_quality(image)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            timings.append(elapsed)
+
+    calls = [image for _ in range(repeat) for image in images]
+    for start in range(0, len(calls), threads):
+        workers = [threading.Thread(target=call, args=(image,)) for image in calls[start:start + threads]]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    return timings
+
+def summarize(label, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    median = statistics.median(ordered)
+    print(f"{label:<18} median {median:7.2f} ms   p95 {p95:7.2f} ms   ({len(ordered)} calls)")
+    return median
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('images', nargs='*', help='image files (default: faces/*.jpg)')
+    parser.add_argument('--repeat', type=int, default=20, help='passes over the image set')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent calling threads')
+    args = parser.parse_args()
+
+    paths = args.images or sorted(glob.glob('faces/*.jpg'))
+    images = [image for image in (cv2.imread(path) for path in paths) if image is not None]
+    if not images:
+        parser.error('no readable images')
+
+    recognizer = FaceRecognition()
+    # Warm up: load cascades and fault in OpenCV code paths before timing
+    time_calls(recognizer, images, 1, args.threads, reload_cascades=False)
+
+    uncached = summarize('reload per call', time_calls(recognizer, images, args.repeat, args.threads, reload_cascades=True))
+    cached = summarize('registry (cached)', time_calls(recognizer, images, args.repeat, args.threads, reload_cascades=False))
+    print(f"speed-up: {uncached / cached:.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,17 @@
 """API blueprint for HTTP endpoints."""
 
-from flask import Blueprint, jsonify, request
-from backend.auth import login_required, teacher_required
+from flask import Blueprint, jsonify, request, session
+from backend.auth import login_required, teacher_required, admin_required
 from services_provider import (
     user_service, 
     attendance_service, 
     attendance_session_service,
     face_recognition_service
 )
+from backend.frames import DecodedFrame, read_image_upload
+from backend.recognition_pool import get_recognition_pool, RecognitionBusy, StaleFrame, RESULT_TIMEOUT
+from backend.dashboard_cache import dashboard_cache
+import concurrent.futures
 import datetime
 
 bp = Blueprint('api', __name__, url_prefix='/api')
@@ -17,13 +21,13 @@ bp = Blueprint('api', __name__, url_prefix='/api')
 def validate_face_quality():
     """Validate face quality in the provided image."""
     try:
-        data = request.get_json()
-        image_data = data.get('image_data')
+        # Raw image/jpeg, multipart or JSON with base64 image_data
+        image_data, params = read_image_upload(request)
         
         if not image_data:
             return jsonify({'success': False, 'message': 'No image data provided'})
         
-        is_valid, message = user_service.validate_face_quality(image_data)
+        is_valid, message = user_service.validate_face_quality(image_data, params.get('pose'))
         return jsonify({'success': is_valid, 'message': message})
         
     except Exception as e:
@@ -43,14 +47,14 @@ def save_attendance():
             return jsonify({'success': False, 'message': 'Missing required parameters'})
         
         # Save attendance records
-        success, message = attendance_service.save_attendance_batch(
+        success, message, errors = attendance_service.save_attendance_batch(
             int(class_id), 
             attendance_date, 
             records, 
             request.user_id
         )
         
-        return jsonify({'success': success, 'message': message})
+        return jsonify({'success': success, 'message': message, 'errors': errors})
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
@@ -111,25 +115,20 @@ def mark_temp_attendance():
 @bp.route('/recognize-face', methods=['POST'])
 @teacher_required
 def recognize_face():
-    """Recognize a student face from an image."""
+    """Identify a student of a class from a face image."""
     try:
-        if 'image' not in request.files:
-            return jsonify({'success': False, 'message': 'No image provided'})
+        # Multipart 'image' file, raw image body or JSON base64 image_data
+        image, params = read_image_upload(request)
+        class_id = params.get('class_id')
         
-        image_file = request.files['image']
-        class_id = request.form.get('class_id')
+        if not image:
+            return jsonify({'success': False, 'message': 'No image provided'})
         
         if not class_id:
             return jsonify({'success': False, 'message': 'Class ID is required'})
         
-        # Validate face quality first
-        quality_result = face_recognition_service.validate_face_quality(image_file)
-        
-        if not quality_result['success']:
-            return jsonify({'success': False, 'message': quality_result['message']})
-        
-        # Reset file pointer
-        image_file.seek(0)
+        if not isinstance(image, DecodedFrame):
+            image = DecodedFrame.from_base64(image)
         
         # Get students in the class
         students = user_service.get_students_by_class(int(class_id))
@@ -137,22 +136,54 @@ def recognize_face():
         if not students:
             return jsonify({'success': False, 'message': 'No students found in this class'})
         
-        # Compare face with student faces
-        student_id = face_recognition_service.recognize_student(image_file, students)
-        
-        if student_id:
-            # Get student details
-            student = user_service.get_user_by_id(student_id)
-            
-            if student:
-                return jsonify({
-                    'success': True,
-                    'student_id': student_id,
-                    'student_name': student.get('name', 'Unknown'),
-                    'roll_number': student.get('roll_number', '')
-                })
-        
-        return jsonify({'success': False, 'message': 'Face not recognized'})
+        # Match against the class's cached embedding matrix on the shared
+        # worker pool; each teacher/class page keeps only its newest frame
+        pool = get_recognition_pool()
+        pool_key = ('class', int(class_id), session.get('user_id'))
+        try:
+            future = pool.submit(pool_key, face_recognition_service.match_face, image, int(class_id))
+            match = future.result(timeout=RESULT_TIMEOUT)
+        except RecognitionBusy:
+            return jsonify({'success': False, 'busy': True, 'message': 'Recognition busy, retry'}), 503, {'Retry-After': '1'}
+        except concurrent.futures.TimeoutError:
+            # Nobody will read this result; don't leave the frame queued
+            pool.cancel(pool_key, future)
+            return jsonify({'success': False, 'busy': True, 'message': 'Recognition busy, retry'}), 503, {'Retry-After': '1'}
+        except (StaleFrame, concurrent.futures.CancelledError):
+            return jsonify({'success': False, 'stale': True, 'message': 'Superseded by a newer frame'}), 409
+        
+        if match is None:
+            return jsonify({'success': False, 'message': 'No face detected'})
+        
+        student = next((s for s in students if s['id'] == match['user_id']), None)
+        if student:
+            return jsonify({
+                'success': True,
+                'student_id': student['id'],
+                'student_name': student.get('name', 'Unknown'),
+                'roll_number': student.get('roll_number', ''),
+                'distance': match['distance'],
+                'margin': match['margin']
+            })
+        
+        return jsonify({
+            'success': False,
+            'message': 'Face not recognized',
+            'distance': match['distance'],
+            'margin': match['margin']
+        })
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@bp.route('/recognition/stats')
+@teacher_required
+def recognition_stats():
+    """Recognition worker pool queue depth, drop and rejection counts."""
+    return jsonify(get_recognition_pool().stats())
+
+@bp.route('/dashboard-cache/stats')
+@admin_required
+def dashboard_cache_stats():
+    """Dashboard cache hit/miss counters."""
+    return jsonify(dashboard_cache.stats())
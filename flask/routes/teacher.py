@@ -1,10 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, Response
 from datetime import datetime, date
 import csv
 import io
 import os
 
 from backend.auth import teacher_required, track_activity
+from backend.frames import DecodedFrame, read_image_upload
+from backend.recognition_pool import RecognitionBusy
 from services_provider import (
     user_service, class_service, attendance_service,
     dashboard_service, attendance_session_service,
@@ -105,9 +107,9 @@ def reports(class_id):
     students = class_service.get_class_students(class_id)
     
     # Add attendance statistics for each student
+    class_stats = attendance_service.get_class_attendance_stats(class_id)
     for student in students:
-        stats = attendance_service.get_attendance_stats(student['id'], class_id)
-        student.update(stats)
+        student.update(class_stats[student['id']])
     
     return render_template('teacher/reports.html', class_data=class_data, students=students)
 
@@ -134,8 +136,9 @@ def export(class_id):
     writer = csv.writer(output)
     writer.writerow(['Student Name', 'Roll Number', 'Total Days', 'Present Days', 'Absent Days', 'Attendance Rate'])
     
+    class_stats = attendance_service.get_class_attendance_stats(class_id)
     for student in students:
-        stats = attendance_service.get_attendance_stats(student['id'], class_id)
+        stats = class_stats[student['id']]
         writer.writerow([
             student['name'],
             student['roll_number'],
@@ -191,6 +194,39 @@ def live_preview_attendance(session_id):
                         unrecognized_faces=unrecognized_faces, 
                         session_id=session_id)
 
+@bp.route('/attendance/live_preview/<int:session_id>/frames', methods=['POST'])
+@teacher_required
+def live_preview_frame(session_id):
+    """Accept the newest camera frame of a live session (raw image body)"""
+    try:
+        image, _ = read_image_upload(request)
+        if not image:
+            return jsonify({'success': False, 'message': 'No image provided'}), 400
+        if not isinstance(image, DecodedFrame):
+            image = DecodedFrame.from_base64(image)
+        
+        live = attendance_session_service.get_live_session(session_id, user_service.face_recognition)
+        try:
+            if live is None or not live.submit_frame(image):
+                return jsonify({'success': False, 'message': 'Session is not in progress'}), 409
+        except RecognitionBusy:
+            return jsonify({'success': False, 'busy': True, 'message': 'Recognition busy, retry'}), 503, {'Retry-After': '1'}
+        
+        # Recognition results arrive on the event stream, not in this response
+        return jsonify({'success': True, 'stats': live.stats()}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 400
+
+@bp.route('/attendance/live_preview/<int:session_id>/events')
+@teacher_required
+def live_preview_events(session_id):
+    """Server-sent event stream of recognition and temporary attendance updates"""
+    live = attendance_session_service.get_live_session(session_id, user_service.face_recognition)
+    if live is None:
+        return jsonify({'success': False, 'message': 'Session is not in progress'}), 409
+    return Response(live.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @bp.route('/attendance/review/<int:session_id>')
 @teacher_required
 def review_attendance(session_id):
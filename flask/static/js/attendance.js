@@ -27,7 +27,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const attendanceRemarks = document.getElementById('attendance-remarks');
     
     // Face API endpoint
-    const FACE_API_ENDPOINT = '/api/v1/recognize-face';
+    const FACE_API_ENDPOINT = '/api/recognize-face';
     const ATTENDANCE_API_ENDPOINT = '/api/v1/mark-attendance-manual';
     const SAVE_ATTENDANCE_ENDPOINT = '/api/v1/attendance/save';
     
@@ -66,6 +66,12 @@ const detectionOptions = {
     const classId = classContainer ? classContainer.dataset.classId : null;
     const className = classContainer ? classContainer.dataset.className : 'Unknown Class';
     
+    // Upload size for recognition frames, advertised by the server on the page
+    const FRAME_MAX_SIDE = parseInt(classContainer?.dataset.frameMaxSide, 10) || 480;
+    const FRAME_QUALITY = parseFloat(classContainer?.dataset.frameQuality) || 0.8;
+    // Extra context kept around a detected face box, as a fraction of its size
+    const FACE_CROP_MARGIN = 0.5;
+    
     // Initialize attendance data
     function initializeAttendanceData() {
         // Get students from the table
@@ -536,8 +542,8 @@ const detectionOptions = {
                     // Update status
                     recognitionStatus.innerHTML = '<div class="text-center"><i class="fas fa-user-check text-green-500 text-2xl mb-2"></i><p>Face detected. Recognizing...</p></div>';
                     
-                    // Recognize face
-                    recognizeFace();
+                    // Recognize face, uploading only the region around it
+                    recognizeFace(boundingBox);
                 } else {
                     recognitionStatus.innerHTML = '<div class="text-center"><i class="fas fa-user-slash text-red-500 text-2xl mb-2"></i><p>No face detected</p><p class="text-sm">Position your face in front of the camera</p></div>';
                     recognizedStudentId = null;
@@ -564,7 +570,42 @@ const detectionOptions = {
         overlayContext.clearRect(0, 0, faceBox.width, faceBox.height);
     }
     
-    async function recognizeFace() {
+    // Encode one JPEG of the face region (or whole frame), downscaled so its
+    // longest side is at most FRAME_MAX_SIDE
+    function captureRecognitionFrame(box) {
+        const videoWidth = videoElement.videoWidth || 640;
+        const videoHeight = videoElement.videoHeight || 480;
+        let sx = 0, sy = 0, sw = videoWidth, sh = videoHeight;
+        
+        if (box) {
+            const marginX = box.width * FACE_CROP_MARGIN;
+            const marginY = box.height * FACE_CROP_MARGIN;
+            sx = Math.max(0, Math.floor(box.x - marginX));
+            sy = Math.max(0, Math.floor(box.y - marginY));
+            sw = Math.min(videoWidth, Math.ceil(box.x + box.width + marginX)) - sx;
+            sh = Math.min(videoHeight, Math.ceil(box.y + box.height + marginY)) - sy;
+        }
+        
+        const scale = Math.min(1, FRAME_MAX_SIDE / Math.max(sw, sh));
+        canvasElement.width = Math.round(sw * scale);
+        canvasElement.height = Math.round(sh * scale);
+        const context = canvasElement.getContext('2d');
+        context.drawImage(videoElement, sx, sy, sw, sh, 0, 0, canvasElement.width, canvasElement.height);
+        
+        return new Promise(resolve => canvasElement.toBlob(resolve, 'image/jpeg', FRAME_QUALITY));
+    }
+    
+    // Data URL copy of an uploaded frame, only needed to show unrecognized faces
+    function blobToDataURL(blob) {
+        return new Promise((resolve, reject) => {
+            const reader = new FileReader();
+            reader.onload = () => resolve(reader.result);
+            reader.onerror = () => reject(reader.error);
+            reader.readAsDataURL(blob);
+        });
+    }
+    
+    async function recognizeFace(box) {
         if (!recognitionActive || !cameraStream) return;
         
         try {
@@ -574,15 +615,8 @@ const detectionOptions = {
                 markAttendanceBtn.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Processing...';
             }
             
-            // Draw current video frame to canvas
-            const context = canvasElement.getContext('2d');
-            context.drawImage(videoElement, 0, 0, canvasElement.width, canvasElement.height);
-            
-            // Convert canvas to blob with higher quality
-            const blob = await new Promise(resolve => canvasElement.toBlob(resolve, 'image/jpeg', 0.95));
-            
-            // Get canvas data URL for unrecognized faces
-            const imageDataUrl = canvasElement.toDataURL('image/jpeg', 0.95);
+            // Single downscaled encode of the current frame
+            const blob = await captureRecognitionFrame(box);
             
             // Create form data
             const formData = new FormData();
@@ -592,6 +626,7 @@ const detectionOptions = {
             // Update status
             recognitionStatus.innerHTML = '<div class="text-center"><i class="fas fa-spinner fa-spin text-blue-500 text-2xl mb-2"></i><p>Processing...</p></div>';
             
+            let result;
             try {
                 // Send to server for recognition
                 const response = await fetch(FACE_API_ENDPOINT, {
@@ -599,11 +634,12 @@ const detectionOptions = {
                     body: formData
                 });
                 
-                if (!response.ok) {
+                // 503: recognition workers are busy; 409: a newer frame replaced this one
+                if (!response.ok && response.status !== 503 && response.status !== 409) {
                     throw new Error(`Server error: ${response.status}`);
                 }
                 
-                const result = await response.json();
+                result = await response.json();
             } catch (apiError) {
                 console.error('Face recognition API error:', apiError);
                 recognitionStatus.innerHTML = `
@@ -620,10 +656,22 @@ const detectionOptions = {
                 }
                 return;
             }
+            
+            if (result.busy || result.stale) {
+                // Not a recognition failure; the next frame will be tried shortly
+                if (result.busy) {
+                    recognitionStatus.innerHTML = '<div class="text-center"><i class="fas fa-hourglass-half text-amber-500 text-2xl mb-2"></i><p>Server busy, retrying...</p></div>';
+                }
+                if (markAttendanceBtn) {
+                    markAttendanceBtn.disabled = false;
+                    markAttendanceBtn.innerHTML = '<i class="fas fa-camera mr-2"></i>Capture & Recognize Face';
+                }
+                return;
+            }
                 
                 if (result.success && result.student_id) {
                 // Student recognized
-                const student = attendanceData.find(s => s.id === result.student_id);
+                const student = attendanceData.find(s => String(s.id) === String(result.student_id));
                 
                 if (student) {
                     // Update recognition status with student info and image
@@ -711,7 +759,7 @@ const detectionOptions = {
                 recognizedStudentId = null;
                 
                 // Add to unrecognized faces
-                addUnrecognizedFace(imageDataUrl);
+                addUnrecognizedFace(await blobToDataURL(blob));
                 
                 // Update unrecognized faces list
                 updateUnrecognizedFacesList();
@@ -17,20 +17,37 @@ function updateInstruction(status) {
   el.innerText = `${prefix}${poses[currentIndex].text}`;
 }
 
-async function captureCurrentPose(base64Image) {
-  const pose = poses[currentIndex].key;
-  const resp = await fetch('/api/capture-face', {
+// Build fetch options for an image upload. Blobs (canvas.toBlob, file inputs)
+// are sent as the raw request body with parameters in the query string;
+// base64 data URLs fall back to the JSON body.
+function imageRequest(url, image, params) {
+  if (image instanceof Blob) {
+    const query = new URLSearchParams(params).toString();
+    return [`${url}?${query}`, {
+      method: 'POST',
+      headers: { 'Content-Type': image.type || 'image/jpeg' },
+      body: image
+    }];
+  }
+  return [url, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ method: 'upload', image_data: base64Image, pose })
-  });
+    body: JSON.stringify({ ...params, image_data: image })
+  }];
+}
+
+async function captureCurrentPose(image) {
+  const pose = poses[currentIndex].key;
+  const resp = await fetch(...imageRequest('/api/capture-face', image, { method: 'upload', pose }));
   const data = await resp.json();
   if (data.success) {
     updateInstruction('✅');
-    try { window.CapturedPoses[pose] = base64Image; } catch (_) {}
+    // Previews only need a URL, so blobs are shown through an object URL
+    const preview = image instanceof Blob ? URL.createObjectURL(image) : image;
+    try { window.CapturedPoses[pose] = preview; } catch (_) {}
     currentIndex += 1;
     // Notify listeners a pose was captured
-    try { window.dispatchEvent(new CustomEvent('pose-captured', { detail: { index: currentIndex, pose, image: base64Image } })); } catch (_) {}
+    try { window.dispatchEvent(new CustomEvent('pose-captured', { detail: { index: currentIndex, pose, image: preview } })); } catch (_) {}
     if (currentIndex < poses.length) {
       setTimeout(() => updateInstruction(''), 600);
     }
@@ -82,13 +99,13 @@ document.addEventListener('DOMContentLoaded', () => {
       : 'mt-4 p-3 rounded-lg bg-red-50 text-red-700';
   }
 
-  function snapshotBase64() {
-    if (!canvas || !video) return null;
+  function snapshotBlob() {
+    if (!canvas || !video) return Promise.resolve(null);
     canvas.width = video.videoWidth || 640;
     canvas.height = video.videoHeight || 480;
     const ctx = canvas.getContext('2d');
     ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-    return canvas.toDataURL('image/jpeg');
+    return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.92));
   }
 
   async function startCameraAuto() {
@@ -172,10 +189,7 @@ document.addEventListener('DOMContentLoaded', () => {
   // Auto-capture loop: checks quality for current pose and captures automatically
   async function validatePose(image, pose) {
     try {
-      const resp = await fetch('/api/validate-face-quality', {
-        method: 'POST', headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ image_data: image, pose })
-      });
+      const resp = await fetch(...imageRequest('/api/validate-face-quality', image, { pose }));
       const data = await resp.json();
       return data;
     } catch (e) {
@@ -190,7 +204,7 @@ document.addEventListener('DOMContentLoaded', () => {
     updateInstruction('');
     while (autoLoopRunning && window.MultiPoseCapture.getRemaining().length > 0) {
       const currentPose = window.MultiPoseCapture.getCurrentPose();
-      const img = snapshotBase64();
+      const img = await snapshotBlob();
       if (!img) { await new Promise(r => setTimeout(r, 300)); continue; }
       const check = await validatePose(img, currentPose);
       if (check.success) {
@@ -211,7 +225,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
   if (captureBtn) {
     captureBtn.addEventListener('click', async () => {
-      const img = snapshotBase64();
+      const img = await snapshotBlob();
       if (!img) return;
       const ok = await captureCurrentPose(img);
       setStatus(ok ? 'Pose saved.' : 'Failed to save pose.', ok);
@@ -237,7 +251,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
   if (uploadBtn) {
     uploadBtn.addEventListener('click', async () => {
-      const src = previewImg ? previewImg.src : null;
+      // Send the selected file as-is; fall back to the preview data URL
+      const file = uploadInput?.files?.[0];
+      const src = file || (previewImg ? previewImg.src : null);
       if (!src) return;
       const ok = await captureCurrentPose(src);
       const box = document.querySelector('#upload-status p');
@@ -556,10 +572,15 @@ async function checkCurrentFaceData() {
         if (!statusDiv) return;
         
         if (result.exists) {
+            // Poses stored by the old embedding pipeline are not used for recognition
+            const reenrollNotice = result.needs_reenrollment
+                ? `<p class="text-sm text-yellow-600">Please capture again: ${result.legacy_poses.join(', ')} saved with an older version</p>`
+                : '';
             statusDiv.innerHTML = `
                 <div class="text-center">
                     <i class="fas fa-check-circle text-3xl text-green-500 mb-2"></i>
                     <p class="text-green-600 font-medium">Face data exists</p>
+                    ${reenrollNotice}
                     <p class="text-sm text-gray-500">Size: ${(result.size / 1024).toFixed(1)} KB</p>
                     <p class="text-sm text-gray-500">Created: ${new Date(result.created).toLocaleDateString()}</p>
                     <button onclick="deleteFaceData()" class="mt-3 bg-red-600 text-white py-1 px-3 rounded text-sm hover:bg-red-700">
@@ -0,0 +1,156 @@
+/**
+ * AI Attendance System - Live Attendance Preview
+ * Streams camera frames to the server and applies recognition and
+ * temporary attendance updates pushed back over server-sent events
+ */
+
+document.addEventListener('DOMContentLoaded', function() {
+    const container = document.getElementById('live-recognition');
+    if (!container) return;
+
+    const videoElement = document.getElementById('live-camera');
+    const canvasElement = document.getElementById('live-canvas');
+    const startBtn = document.getElementById('live-start');
+    const stopBtn = document.getElementById('live-stop');
+    const statusElement = document.getElementById('live-status');
+    const presentList = document.getElementById('present-list');
+    const absentList = document.getElementById('absent-list');
+
+    const FRAMES_URL = container.dataset.framesUrl;
+    const EVENTS_URL = container.dataset.eventsUrl;
+    const FRAME_MAX_SIDE = parseInt(container.dataset.frameMaxSide, 10) || 480;
+    const FRAME_QUALITY = parseFloat(container.dataset.frameQuality) || 0.8;
+    // Pause between uploads; the server only keeps the newest frame anyway
+    const FRAME_INTERVAL = parseInt(container.dataset.frameInterval, 10) || 3000;
+    const PRESENT = 'Present (Temporary)';
+    const ABSENT = 'Absent (Temporary)';
+
+    let cameraStream = null;
+    let eventSource = null;
+    let streaming = false;
+
+    function setStatus(text) {
+        if (statusElement) statusElement.textContent = text;
+    }
+
+    // Encode one downscaled JPEG of the current video frame
+    function captureFrame() {
+        const width = videoElement.videoWidth;
+        const height = videoElement.videoHeight;
+        if (!width || !height) return Promise.resolve(null);
+
+        const scale = Math.min(1, FRAME_MAX_SIDE / Math.max(width, height));
+        canvasElement.width = Math.round(width * scale);
+        canvasElement.height = Math.round(height * scale);
+        canvasElement.getContext('2d').drawImage(videoElement, 0, 0, canvasElement.width, canvasElement.height);
+
+        return new Promise(resolve => canvasElement.toBlob(resolve, 'image/jpeg', FRAME_QUALITY));
+    }
+
+    // Upload frames one at a time; results come back on the event stream
+    async function sendFrames() {
+        while (streaming) {
+            // Nobody is watching a background tab; don't spend recognition on it
+            const blob = document.hidden ? null : await captureFrame();
+            if (blob) {
+                try {
+                    const response = await fetch(FRAMES_URL, {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'image/jpeg' },
+                        body: blob
+                    });
+                    if (response.status === 409) {
+                        setStatus('Session is no longer in progress.');
+                        stopLive();
+                        return;
+                    }
+                } catch (error) {
+                    console.error('Frame upload error:', error);
+                }
+            }
+            await new Promise(resolve => setTimeout(resolve, FRAME_INTERVAL));
+        }
+    }
+
+    // Move (or add) a student's entry to the list matching their status
+    function applyAttendance(update) {
+        const studentId = String(update.student_id);
+        let item = document.querySelector(`li[data-student-id="${studentId}"]`);
+        if (!item) {
+            item = document.createElement('li');
+            item.dataset.studentId = studentId;
+        }
+        item.innerHTML = `${studentId} - ${update.status}
+            <input type="hidden" name="student_id" value="${studentId}">
+            <select name="status">
+                <option value="${PRESENT}" ${update.status === PRESENT ? 'selected' : ''}>${PRESENT}</option>
+                <option value="${ABSENT}" ${update.status === ABSENT ? 'selected' : ''}>${ABSENT}</option>
+            </select>`;
+        const list = update.status === PRESENT ? presentList : absentList;
+        if (list) list.appendChild(item);
+    }
+
+    function openEvents() {
+        eventSource = new EventSource(EVENTS_URL);
+
+        eventSource.addEventListener('recognition', (e) => {
+            const result = JSON.parse(e.data);
+            if (!result.face) {
+                setStatus('No face detected');
+            } else if (result.student_id) {
+                setStatus(`Recognized student ${result.student_id} (distance ${result.distance.toFixed(3)})`);
+            } else {
+                setStatus('Face not recognized');
+            }
+        });
+
+        eventSource.addEventListener('attendance', (e) => applyAttendance(JSON.parse(e.data)));
+
+        eventSource.addEventListener('recognition_error', (e) => setStatus(JSON.parse(e.data).message));
+
+        eventSource.addEventListener('closed', () => {
+            setStatus('Attendance session finalized.');
+            stopLive();
+        });
+    }
+
+    async function startLive() {
+        try {
+            cameraStream = await navigator.mediaDevices.getUserMedia({ video: true });
+            videoElement.srcObject = cameraStream;
+            await videoElement.play();
+        } catch (error) {
+            setStatus('Camera error: ' + error.message);
+            return;
+        }
+
+        startBtn.classList.add('hidden');
+        stopBtn.classList.remove('hidden');
+        setStatus('Camera started. Recognizing...');
+
+        openEvents();
+        streaming = true;
+        sendFrames();
+    }
+
+    function stopLive() {
+        streaming = false;
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
+        if (cameraStream) {
+            cameraStream.getTracks().forEach(track => track.stop());
+            cameraStream = null;
+        }
+        videoElement.srcObject = null;
+        startBtn.classList.remove('hidden');
+        stopBtn.classList.add('hidden');
+    }
+
+    startBtn.addEventListener('click', startLive);
+    stopBtn.addEventListener('click', () => {
+        stopLive();
+        setStatus('Camera stopped.');
+    });
+});
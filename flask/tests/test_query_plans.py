@@ -0,0 +1,40 @@
+"""EXPLAIN QUERY PLAN checks for the hot query paths covered by Database.INDEXES."""
+
+import pytest
+from backend.database import Database
+from backend.models import UserActivity, Attendance, ClassAssignment
+
+HOT_QUERIES = {
+    'recent_activity': lambda db: UserActivity(db).get_recent_activity(24),
+    'class_attendance_by_date_range': lambda db: Attendance(db).get_class_attendance_by_date_range(1, '2025-01-01', '2025-01-31'),
+    'user_classes': lambda db: ClassAssignment(db).get_user_classes(3, 'student'),
+    'class_attendance_stats': lambda db: Attendance(db).get_class_attendance_stats(1, '2025-01-01', '2025-01-31'),
+}
+
+@pytest.fixture(scope='module')
+def db(tmp_path_factory):
+    database = Database(str(tmp_path_factory.mktemp('plans') / 'attendance.db'))
+    database.init_db()
+    return database
+
+def captured_statements(db, run):
+    """Run a model method and return the SQL it executed"""
+    conn = db.get_db()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        run(db)
+    finally:
+        conn.set_trace_callback(None)
+        conn.close()
+    return [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_query_uses_indexes(db, name):
+    statements = captured_statements(db, HOT_QUERIES[name])
+    assert statements, f'{name} ran no SELECT'
+    for sql in statements:
+        plan = db.explain_query_plan(sql)
+        scans = [detail for detail in plan if detail.startswith('SCAN')]
+        assert not scans, f'{name} regressed to a table scan: {plan}'
+        assert any(detail.startswith('SEARCH') for detail in plan), plan